@@ -1,11 +1,19 @@
 # Notes:
-#   - Need to read from a file and parse into a similar array (input instruction array)
-#   - Validation of instructions provided should be handled. Ex: Register names and bounds should be valid & their format
+#   - Command line: python -m Tom prog1.s prog2.json --config machine.json [--config other.json] runs every program
+#     on every configuration in one process (python -m Tom --help); importing Tom runs nothing
+#   - Programs can be written as assembly files and turned into the instruction array with assembler.py,
+#     which also validates register names and immediate ranges
+#   - batch.py simulates a program on thousands of num_rs / instruction_cycles configurations in lockstep
+#     with NumPy arrays (sweep.py --batch); a configuration with a predictor other than not_taken, a ROB,
+#     renaming or unit pools is run on Tomasulo itself
+#   - python -m pytest test_tomasulo.py checks that the event-driven clock, checkpoints and batch.py give the
+#     same results as the cycle-by-cycle run, and that it ends in FunctionalSim's state
 
 # Done
 #   - Ensure that R0 does not get overwritten
 #   - Registers and Memory should be taken into account and implemented
-#   - Reservation station and functional units have a 1-to-1 relationship
+#   - Reservation station and functional units have a 1-to-1 relationship by default; num_fus / initiation_interval
+#     give each type its own pool of (pipelined) units instead, handed to the oldest ready stations first
 #   - Need to update the qj/k to none after writing an instruction
 #   - Simulating Clock Cycles is implemented
 #   - Number of execution cycles for each instruction should be input from the user
@@ -14,18 +22,311 @@
 #   - JAL and RET Stalling
 #   - Conditions for each instruction type
 #   - WAW Hazard
+#   - CDB broadcast is indexed by producer tag (consumers / tag_dest) instead of scanning every station
+#   - Per-unit ready lists: execute_all only visits stations whose operands have arrived
+#   - Event-driven clock (event_driven=True) jumps over cycles where stations only count down
+#   - Level-gated tracing (TRACE_OFF / SUMMARY / EVENTS / FULL) to stdout, a buffered file or a list
+#   - Each op is an OpHandler registered once in OP_HANDLERS; instructions are pre-decoded at load
+#   - Branch prediction (static not-taken, bimodal BTB, gshare): instructions behind a branch execute
+#     speculatively and write once it resolves; a misprediction squashes everything younger
+#   - JAL links pc + 1, RET waits for R1 and stalls issue like JAL
+#   - FunctionalSim: ISA-level fast-forward (Tomasulo.fast_forward) and sampled simulation (run_sampled)
+#   - Older instructions get priority to write: oldest-first CDB arbitration over num_cdb buses
+#   - Superscalar front end: fetch_width / issue_width instructions per cycle through an instruction queue
+#   - run() returns a RunResult: IPC, stall cycles by reason, CDB conflicts, station occupancy and unit utilization
+#   - Optional reorder buffer (rob_size): in-order commit of registers and stores, JAL / RET predicted with a
+#     return address stack, mispredictions flush at commit, faults only raised for committed instructions
+#   - Load-store queue: a LOAD waits for older STOREs with unknown or equal addresses (forwarding the data of the
+#     latest one to its address), a STORE without a ROB waits for older LOADs / STOREs to its address
+#   - Optional register renaming (num_phys_regs): R0-R7 map onto a pool of physical registers with a free list,
+#     so a write to a register that is still waiting on a result issues instead of stalling for WAW
+#   - ResultCache (result_cache=): runs keyed by a hash of their starting state are kept on disk as the checkpoint
+#     of their final state, with a size cap and least recently used eviction
+#   - Streaming programs: instructions can be a generator or file reader (assembler.stream_program), read lazily
+#     through an InstructionSource window, and the run ends when the stream runs out
+#   - Trace-driven mode (trace_driven=True, python -m Tom --trace-driven): the instructions are a dynamic trace
+#     (FunctionalSim.trace() writes one), so a BNE / JAL / RET is followed by the record that really ran next
+#     and never redirects fetch. Fetch thus follows the right path like a perfect predictor, and JAL links
+#     its position in the trace + 1 rather than its pc in the program
+#   - Profiling (profile=True or Profiler(cprofile_cycles=[first, last]), python -m Tom --profile): host time and calls
+#     of every stage and op, printed when the run ends; without it no stage method is wrapped
 
 ##############################
 #What's Left:
-#   - Need to give priority to older instruction to write
-#   - Storing/Loading addresses are not equal --> if they are, do not issue second instruction
+#   - WAW still stalls issue unless register renaming (num_phys_regs) is on
+#   - batch.py: bimodal / gshare, the ROB and renaming still take one Tomasulo run per configuration, and a
+#     batch of thousands costs a few hundred scalar runs rather than a handful
+
+import argparse
+import bisect
+import collections
+import cProfile
+import csv
+import hashlib
+import heapq
+import io
+import json
+import mmap
+import os
+import pickle
+import pstats
+import struct
+import sys
+import time
+import zlib
+
+from assembler import load_program, stream_program, write_cache_file
+
+# Trace levels: each level includes everything below it
+TRACE_OFF = 0  # no output at all
+TRACE_SUMMARY = 1  # final state and total clock cycles
+TRACE_EVENTS = 2  # issue / execute / write events of every cycle
+TRACE_FULL = 3  # plus reservation stations, register status and register file after every cycle
+TRACE_NAMES = {"off": TRACE_OFF, "summary": TRACE_SUMMARY, "events": TRACE_EVENTS, "full": TRACE_FULL}
+
+# Reasons the front end could not issue, indexes into Tomasulo.stall_counts
+STALL_RS_FULL = 0  # every station of the instruction's type is busy
+STALL_WAW = 1  # register_stat[rd] != None
+STALL_JAL = 2  # a JAL / RET has not written yet
+STALL_BRANCH = 3  # a branch while max_branches are already unresolved
+STALL_ROB_FULL = 4  # no free reorder buffer entry
+STALL_RENAME = 5  # no free physical register to rename the destination to
+STALL_NAMES = ["rs_full", "waw", "jal", "branch", "rob_full", "rename"]
+
+class StdoutSink:
+    def write(self, line):
+        print(line)
+
+    def flush(self):
+        return
+
+class FileSink:
+    # Buffered so a long trace is written in large blocks instead of line by line
+    def __init__(self, path, buffer_size=1 << 20):
+        self.file = open(path, "w", buffering=buffer_size)
+
+    def write(self, line):
+        self.file.write(line + "\n")
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class ListSink:
+    # Keeps the trace in memory, mostly useful for inspecting a run from another script
+    def __init__(self):
+        self.lines = []
+
+    def write(self, line):
+        self.lines.append(line)
+
+    def flush(self):
+        return
+
+class Tracer:
+    def __init__(self, level=TRACE_FULL, sink=None):
+        self.level = level
+        self.sink = sink if sink != None else StdoutSink()
+
+    def log(self, *args):
+        # Same spacing as print(*args); callers check the level first so disabled tracing formats nothing
+        self.sink.write(" ".join(str(arg) for arg in args))
+
+    def flush(self):
+        self.sink.flush()
+
+class Profiler:
+    # Host time and call counts per pipeline stage and per opcode. Tomasulo(profile=...) puts timed wrappers
+    # over its own stage methods, so a run without a profiler executes exactly the code it did before.
+    # cprofile_cycles=[first, last] also runs those cycles under cProfile.
+    STAGES = [["fetch", "fetch_all"], ["issue", "issue_all"], ["execute", "execute_all"], ["commit", "commit_all"],
+              ["write", "write_all"], ["termination", "free_stations"], ["skip", "skip_idle_cycles"]]
+    OP_METHODS = [["issue", "issue"], ["execute", "check_to_execute"], ["write", "write"]]
+
+    def __init__(self, cprofile_cycles=None):
+        self.times = {} # stage or [stage, op] -> host seconds
+        self.calls = {}
+        self.cprofile_cycles = cprofile_cycles
+        self.cprofile = None
+        self.cprofiling = False
+        self.in_stage = False # a stage is being timed: a stage it calls (fetch_all in skip_idle_cycles) is charged to it
+
+    def attach(self, sim):
+        for [name, method] in self.STAGES:
+            setattr(sim, method, self.timed(name, getattr(sim, method)))
+        for [name, method] in self.OP_METHODS:
+            setattr(sim, method, self.timed_op(name, getattr(sim, method)))
+        if self.cprofile_cycles != None:
+            sim.fetch_all = self.cycle_hook(sim, sim.fetch_all)
+
+    def timed(self, name, method):
+        times = self.times
+        calls = self.calls
+        times[name] = 0.0
+        calls[name] = 0
+        clock = time.perf_counter
+
+        def wrapper(*args):
+            if self.in_stage == True:
+                return method(*args)
+            self.in_stage = True
+            start = clock()
+            try:
+                result = method(*args)
+            finally:
+                self.in_stage = False
+            times[name] += clock() - start
+            calls[name] += 1
+            return result
+        return wrapper
+
+    def timed_op(self, name, method):
+        # issue(instruction, ...) / check_to_execute(op, i) / write(op, i): charged to the op of the call
+        times = self.times
+        calls = self.calls
+        clock = time.perf_counter
+
+        def wrapper(first, *args):
+            key = (name, first if isinstance(first, str) else first.op)
+            start = clock()
+            result = method(first, *args)
+            times[key] = times.get(key, 0.0) + clock() - start
+            calls[key] = calls.get(key, 0) + 1
+            return result
+        return wrapper
+
+    def cycle_hook(self, sim, method):
+        # First stage of every cycle: switch cProfile on inside cprofile_cycles and off after it
+        [first, last] = self.cprofile_cycles
+
+        def wrapper(*args):
+            if self.cprofiling == False and first <= sim.clock_cycles <= last:
+                if self.cprofile == None:
+                    self.cprofile = cProfile.Profile()
+                self.cprofile.enable()
+                self.cprofiling = True
+            elif self.cprofiling == True and sim.clock_cycles > last:
+                self.stop()
+            return method(*args)
+        return wrapper
+
+    def stop(self):
+        if self.cprofiling == True:
+            self.cprofile.disable()
+            self.cprofiling = False
+
+    def report(self, top=20):
+        # Stages, then op handlers, slowest first. Stage times do not overlap, so their shares add up to
+        # 100%; an op's time is part of its stage's
+        self.stop()
+        stages = [key for key in self.times if isinstance(key, str)]
+        ops = [key for key in self.times if not isinstance(key, str)]
+        total = sum(self.times[key] for key in stages)
+        lines = [f"{'stage':<20} {'host s':>9} {'share':>6} {'calls':>9} {'us/call':>8}"]
+        for key in sorted(stages, key=lambda key: -self.times[key]):
+            if self.calls[key] > 0:
+                lines.append(self.line(key, key, total))
+        lines.append(f"{'total':<20} {total:>9.4f}")
+        lines.append(f"{'op':<20} {'host s':>9} {'share':>6} {'calls':>9} {'us/call':>8}")
+        for key in sorted(ops, key=lambda key: -self.times[key]):
+            lines.append(self.line(f"{key[0]} {key[1]}", key, total))
+        if self.cprofile != None:
+            text = io.StringIO()
+            pstats.Stats(self.cprofile, stream=text).sort_stats("cumulative").print_stats(top)
+            lines.append(f"cProfile of cycles {self.cprofile_cycles[0]} to {self.cprofile_cycles[1]}:")
+            lines += text.getvalue().rstrip().splitlines()
+        return lines
+
+    def line(self, label, key, total):
+        seconds = self.times[key]
+        calls = self.calls[key]
+        share = seconds / total if total > 0 else 0.0
+        return f"{label:<20} {seconds:>9.4f} {share:>6.1%} {calls:>9} {seconds / calls * 1e6 if calls > 0 else 0:>8.2f}"
+
+class Memory:
+    # Byte-addressable data memory backed by a bytearray. LOAD / STORE move one signed little-endian
+    # word of word_size bytes at a byte address, which must be in bounds and word aligned.
+    WORD_FORMATS = {1: "<b", 2: "<h", 4: "<i", 8: "<q"}
+
+    def __init__(self, capacity=128 * 1024, word_size=4):
+        if word_size not in self.WORD_FORMATS:
+            raise ValueError(f"Unsupported word size {word_size}, expected 1, 2, 4 or 8 bytes")
+        if capacity % word_size != 0:
+            raise ValueError(f"Memory capacity {capacity} is not a multiple of the word size {word_size}")
+        self.capacity = capacity
+        self.word_size = word_size
+        self.word = struct.Struct(self.WORD_FORMATS[word_size])
+        self.bits = 8 * word_size
+        self.data = bytearray(capacity)
+
+    def check(self, address):
+        if address < 0 or address + self.word_size > self.capacity:
+            raise IndexError(f"Memory address {address} out of range [0, {self.capacity - self.word_size}]")
+        if address % self.word_size != 0:
+            raise ValueError(f"Memory address {address} is not aligned to {self.word_size} bytes")
+
+    def __getitem__(self, address):
+        self.check(address)
+        return self.word.unpack_from(self.data, address)[0]
+
+    def __setitem__(self, address, value):
+        self.check(address)
+        # Wrap to the word size the same way the hardware would truncate the register
+        value &= (1 << self.bits) - 1
+        if value >= 1 << (self.bits - 1):
+            value -= 1 << self.bits
+        self.word.pack_into(self.data, address, value)
+
+    def __len__(self):
+        return self.capacity // self.word_size # number of words
+
+    def words(self):
+        # (address, value) of every non-zero word
+        for i, [value] in enumerate(self.word.iter_unpack(self.data)):
+            if value != 0:
+                yield i * self.word_size, value
+
+    def load_image(self, path, address=0):
+        # Copy a raw binary image into memory starting at address, straight from an mmap of the file
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return 0
+            if address < 0 or address + size > self.capacity:
+                raise IndexError(f"Image of {size} bytes at address {address} does not fit in {self.capacity} bytes of memory")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as image:
+                self.data[address:address + size] = image
+        return size
+
+    def dump_image(self, path, start=0, end=None):
+        with open(path, "wb") as f:
+            f.write(memoryview(self.data)[start:end])
+
+# Instruction types in station order; an opcode is the type's index here
+INST_TYPES = ["LOAD", "STORE", "BNE", "JAL", "RET", "ADD", "ADDI", "NEG", "NAND", "SLL"]
+OPCODES = {inst: opcode for opcode, inst in enumerate(INST_TYPES)}
+
+# Station fields saved in a checkpoint (name, index, tag and op are fixed by the configuration)
+STATION_STATE = ("busy", "vj", "vk", "qj", "qk", "rd", "offset", "A", "pc", "result", "executed",
+                 "total_ex_cycles", "issue_cycle", "execute_cycle", "done_cycle", "seq", "prediction", "fault",
+                 "phys", "prev_phys")
+CHECKPOINT_VERSION = 8
 
 class ReservationStation:
-    def __init__(self, index, name, op, busy=False, vj=None, vk=None, qj=None, qk=None, rd=None, offset=None, A=None, pc = None):
+    # Fixed slots instead of a per-station __dict__: smaller and faster to access with hundreds of stations
+    __slots__ = ("index", "name", "tag", "busy", "op", "opcode", "vj", "vk", "qj", "qk", "rd", "offset", "A", "pc",
+                 "result", "executed", "total_ex_cycles", "issue_cycle", "execute_cycle", "done_cycle", "seq",
+                 "prediction", "fault", "phys", "prev_phys")
+
+    def __init__(self, index, name, op, busy=False, vj=None, vk=None, qj=None, qk=None, rd=None, offset=None, A=None, pc = None, tag=None):
         self.index = index
         self.name = name
+        self.tag = tag # position in Tomasulo.stations; qj / qk / register_stat hold this int
         self.busy = busy
         self.op = op
+        self.opcode = OPCODES[op]
         self.vj = vj
         self.vk = vk
         self.qj = qj
@@ -39,23 +340,631 @@ class ReservationStation:
         self.total_ex_cycles = None
         self.issue_cycle = 100
         self.execute_cycle = 100
+        self.done_cycle = None # projected last execution cycle, used by the event-driven clock
+        self.seq = None # issue order, the older instruction wins the CDB
+        self.prediction = None # BNE: predicted target, None for not taken
+        self.fault = None # exception raised while executing, raised again once the instruction is not speculative
+        self.phys = None # renaming: physical register the result goes to
+        self.prev_phys = None # and the one rd was mapped to before, freed once nothing can go back to it
         # self.write_cycle = None
 
     def __iter__(self):
         return self
 
+class OpHandler:
+    # How one instruction type issues, executes and writes back. Each op is registered once in
+    # OP_HANDLERS and the engine only ever calls through the handler, so a new op plugs in
+    # by registering another handler (plus its num_rs / instruction_cycles entries).
+    #   sources   - [instruction field or fixed register, operand] pairs filled at issue, e.g. ["rs1", "j"]
+    #   dest      - "rd" for the instruction's rd, a fixed register name, or None
+    #   deps      - operands that must arrive before executing (default: all sources)
+    #   execute   - f(sim, station) run on every execution cycle, computes station.result
+    #   complete  - f(sim, station) run once when the last execution cycle finishes
+    #   write     - f(sim, station) run when the station gets the CDB
+    #   branch    - predicted at fetch; younger instructions cannot write until it resolves
+    #   stalls_issue - nothing else issues until it has written (JAL, RET), unless there is a ROB
+    #   memory    - "load" / "store": which load-store queue it goes through from issue until it is done
+    #   call      - jumps to pc + imm and pushes pc + 1 on the return address stack (JAL)
+    #   returns   - jumps to the address popped off the return address stack (RET)
+    #   functional - f(sim, instruction, pc) -> next pc, the ISA-level behaviour used by FunctionalSim
+    def __init__(self, op, sources, dest=None, deps=None, execute=None, complete=None, write=None,
+                 branch=False, stalls_issue=False, call=False, returns=False, memory=None, functional=None):
+        self.op = op
+        self.sources = sources
+        self.dest = dest
+        self.deps = deps if deps != None else [operand for [field, operand] in sources]
+        self.execute = execute
+        self.complete = complete
+        self.write = write
+        self.branch = branch
+        self.stalls_issue = stalls_issue
+        self.call = call
+        self.returns = returns
+        self.memory = memory
+        self.functional = functional
+
+OP_HANDLERS = {}
+
+def register_op(handler):
+    OP_HANDLERS[handler.op] = handler
+    if handler.op not in OPCODES:
+        OPCODES[handler.op] = len(INST_TYPES)
+        INST_TYPES.append(handler.op)
+    return handler
+
+class DecodedInstruction:
+    # An instruction with its handler resolved once at program load
+    __slots__ = ("handler", "op", "rd", "rs1", "rs2", "imm", "source")
+
+    def __init__(self, instruction):
+        self.handler = OP_HANDLERS[instruction.get("op")]
+        self.op = instruction.get("op")
+        self.rd = instruction.get("rd")
+        self.rs1 = instruction.get("rs1")
+        self.rs2 = instruction.get("rs2")
+        self.imm = instruction.get("imm")
+        self.source = instruction
+
+    def __repr__(self):
+        return repr(self.source)
+
+class InstructionSource:
+    # The program by pc. A list is decoded up front and kept whole; any other iterable of instructions
+    # (a generator, a file read line by line) is decoded lazily as fetch reaches it, and only the last
+    # `window` instructions before the furthest one read are kept, so a long stream runs in constant
+    # memory. Branches and jumps back into the stream must stay inside that window.
+    def __init__(self, instructions, window=4096):
+        self.base = 0 # pc of window[0]
+        self.size = window
+        if isinstance(instructions, (list, tuple)):
+            self.iterator = None
+            self.window = [instruction if isinstance(instruction, DecodedInstruction) else DecodedInstruction(instruction)
+                           for instruction in instructions]
+            self.end = len(self.window)
+        else:
+            self.iterator = iter(instructions)
+            self.window = []
+            self.end = None # one past the last pc, known once the iterable runs out
+
+    def get(self, pc):
+        # Instruction at pc, None outside the program
+        i = pc - self.base
+        if 0 <= i < len(self.window):
+            return self.window[i]
+        if pc < 0 or (self.end != None and pc >= self.end):
+            return None
+        if pc < self.base:
+            raise ValueError(f"pc {pc} is no longer in the last {self.size} instructions of the stream")
+        while self.end == None and pc >= self.base + len(self.window):
+            self.read()
+        return self.window[pc - self.base] if pc < self.base + len(self.window) else None
+
+    def has(self, pc):
+        if 0 <= pc - self.base < len(self.window): # hot path: called by fetch and issue every cycle
+            return True
+        return self.get(pc) != None
+
+    def read(self):
+        try:
+            instruction = next(self.iterator)
+        except StopIteration:
+            self.end = self.base + len(self.window)
+            self.iterator = None
+            return
+        self.window.append(instruction if isinstance(instruction, DecodedInstruction) else DecodedInstruction(instruction))
+        if len(self.window) >= 2 * self.size: # drop in blocks so trimming is not paid per instruction
+            drop = len(self.window) - self.size
+            del self.window[:drop]
+            self.base += drop
+
+class RobEntry:
+    # One in-flight instruction in the reorder buffer, from issue until it commits in program order
+    __slots__ = ("seq", "op", "pc", "dest", "value", "address", "next_pc", "predicted", "done", "fault", "phys",
+                 "prev_phys")
+
+    def __init__(self, seq, op, pc, dest, predicted):
+        self.seq = seq
+        self.op = op
+        self.pc = pc
+        self.dest = dest # register written at commit
+        self.value = None # result, or the value a STORE writes at commit
+        self.address = None # STORE address
+        self.next_pc = None # JAL / RET / BNE: where execution really continues
+        self.predicted = predicted # where fetch continued after it
+        self.done = False # written back, can commit
+        self.fault = None
+        self.phys = None # renaming: physical register of dest, and the one it replaces (freed at commit)
+        self.prev_phys = None
+
+class AddressQueue:
+    # The LOADs or the STOREs of the load-store queue, by issue order (seq). Indexed by address so an
+    # ordering check is a dict lookup and a bisect instead of a scan over every memory operation in flight.
+    def __init__(self):
+        self.unknown = [] # seqs whose address is not computed yet, oldest first
+        self.by_address = {} # address -> seqs to that address, oldest first
+        self.entries = {} # seq -> [address (None while unknown), station tag], in issue order
+
+    def add(self, seq, tag):
+        self.unknown.append(seq) # seqs only grow, so appending keeps it sorted
+        self.entries[seq] = [None, tag]
+
+    def resolve(self, seq, address):
+        del self.unknown[bisect.bisect_left(self.unknown, seq)]
+        self.entries[seq][0] = address
+        bisect.insort(self.by_address.setdefault(address, []), seq)
+
+    def remove(self, seq):
+        [address, tag] = self.entries.pop(seq)
+        seqs = self.unknown if address == None else self.by_address[address]
+        del seqs[bisect.bisect_left(seqs, seq)]
+        if address != None and len(seqs) == 0:
+            del self.by_address[address]
+
+    def squash(self, seq):
+        # Drop everything issued after seq, youngest first
+        while len(self.entries) > 0 and next(reversed(self.entries)) > seq:
+            self.remove(next(reversed(self.entries)))
+
+    def unknown_before(self, seq):
+        return len(self.unknown) > 0 and self.unknown[0] < seq
+
+    def latest_before(self, seq, address):
+        # Youngest seq older than seq to address, None if there is none
+        seqs = self.by_address.get(address)
+        if seqs == None:
+            return None
+        i = bisect.bisect_left(seqs, seq)
+        return seqs[i - 1] if i > 0 else None
+
+def execute_load(sim, station):
+    if station.total_ex_cycles == sim.instuction_cycles[station.op]: # effective address on the first cycle only
+        sim.resolve_address(station, station.vj + station.A)
+        sim.memory.check(station.A) # the read itself happens at write, once older STOREs allow it, Lec 18 Slide 6
+
+def execute_store(sim, station):
+    if station.total_ex_cycles == sim.instuction_cycles[station.op]: # Lec 18 Slide 7.
+        sim.resolve_address(station, station.vj + station.A)
+        sim.memory.check(station.A)
+
+def execute_bne(sim, station):
+    if (station.vj != station.vk): # branch taken
+        station.result = station.A + station.pc
+
+def execute_jal(sim, station):
+    station.result = station.pc + 1 # return address, linked into R1
+    station.offset = station.A + station.pc # jump target
+
+def execute_ret(sim, station):
+    station.result = station.vj # R1, captured through the register status like any other operand
+
+def execute_add(sim, station):
+    station.result = station.vj + station.vk
+
+def execute_addi(sim, station):
+    station.result = station.vj + station.A
+
+def execute_neg(sim, station):
+    station.result = -1 * station.vj
+
+def execute_nand(sim, station):
+    station.result = ~(station.vj & station.vk)
+
+def execute_sll(sim, station):
+    station.result = station.vj << station.vk
+
+def write_store(sim, station):
+    if (station.qk == None and sim.store_blocked(station) == False):
+        sim.store(station)
+        sim.empty_entry(station)
+        if sim.trace_level >= TRACE_EVENTS:
+            sim.tracer.log("I, ", station.op, ", am writing in clock cycle: ", sim.clock_cycles)
+
+# The writes below each take one of the cycle's common data buses (sim.cdb -= 1), STORE's does not
+def write_bne(sim, station):
+    # The branch resolves when it writes: it is the oldest unresolved one by then
+    sim.resolve_branch(station)
+    if sim.trace_level >= TRACE_EVENTS:
+        sim.tracer.log("I, ", station.op, ", am writing in clock cycle: ", sim.clock_cycles, "New PC: ", sim.glob_pc)
+    sim.empty_entry(station)
+    sim.cdb -= 1
+
+def write_redirect(sim, station): # RET
+    sim.jump(station, station.result)
+    if sim.trace_level >= TRACE_EVENTS:
+        sim.tracer.log("I, ", station.op, ", am writing in clock cycle: ", sim.clock_cycles, "New PC: ", sim.glob_pc)
+    sim.empty_entry(station)
+    sim.cdb -= 1
+
+def write_load(sim, station):
+    if sim.load_blocked(station) == True: # retried next cycle
+        return
+    station.result = sim.load(station)
+    write_result(sim, station)
+
+def write_result(sim, station): # LOAD and arithmetic operations
+    sim.broadcast(station)
+    sim.empty_entry(station)
+    sim.cdb -= 1
+    if sim.trace_level >= TRACE_EVENTS:
+        sim.tracer.log("I, ", station.op, ", am writing in clock cycle: ", sim.clock_cycles)
+
+def write_jal(sim, station):
+    sim.broadcast(station)
+    sim.jump(station, station.offset)
+    sim.empty_entry(station)
+    sim.cdb -= 1
+    if sim.trace_level >= TRACE_EVENTS:
+        sim.tracer.log("I, ", station.op, ", am writing in clock cycle: ", sim.clock_cycles)
+
+# Functional (ISA-level) behaviour of each op: update registers / memory, return the next pc
+def step_load(sim, inst, pc):
+    sim.set_reg(inst.rd, sim.memory[sim.RegFile[inst.rs1] + inst.imm])
+    return pc + 1
+
+def step_store(sim, inst, pc):
+    sim.memory[sim.RegFile[inst.rs1] + inst.imm] = sim.RegFile[inst.rs2]
+    return pc + 1
+
+def step_bne(sim, inst, pc):
+    if sim.RegFile[inst.rs1] != sim.RegFile[inst.rs2]:
+        return pc + inst.imm
+    return pc + 1
+
+def step_jal(sim, inst, pc):
+    sim.set_reg("R1", pc + 1)
+    return pc + inst.imm
+
+def step_ret(sim, inst, pc):
+    return sim.RegFile["R1"]
+
+def step_add(sim, inst, pc):
+    sim.set_reg(inst.rd, sim.RegFile[inst.rs1] + sim.RegFile[inst.rs2])
+    return pc + 1
+
+def step_addi(sim, inst, pc):
+    sim.set_reg(inst.rd, sim.RegFile[inst.rs1] + inst.imm)
+    return pc + 1
+
+def step_neg(sim, inst, pc):
+    sim.set_reg(inst.rd, -1 * sim.RegFile[inst.rs1])
+    return pc + 1
+
+def step_nand(sim, inst, pc):
+    sim.set_reg(inst.rd, ~(sim.RegFile[inst.rs1] & sim.RegFile[inst.rs2]))
+    return pc + 1
+
+def step_sll(sim, inst, pc):
+    sim.set_reg(inst.rd, sim.RegFile[inst.rs1] << sim.RegFile[inst.rs2])
+    return pc + 1
+
+# STORE only needs its address operand to execute, the value (vk) is needed at write
+register_op(OpHandler("LOAD", [["rs1", "j"]], dest="rd", execute=execute_load, write=write_load, memory="load", functional=step_load))
+register_op(OpHandler("STORE", [["rs1", "j"], ["rs2", "k"]], deps=["j"], execute=execute_store, write=write_store, memory="store", functional=step_store))
+register_op(OpHandler("BNE", [["rs1", "j"], ["rs2", "k"]], execute=execute_bne, write=write_bne, branch=True, functional=step_bne))
+register_op(OpHandler("JAL", [], dest="R1", execute=execute_jal, write=write_jal, stalls_issue=True, call=True, functional=step_jal))
+register_op(OpHandler("RET", [["R1", "j"]], execute=execute_ret, write=write_redirect, stalls_issue=True, returns=True, functional=step_ret))
+register_op(OpHandler("ADD", [["rs1", "j"], ["rs2", "k"]], dest="rd", execute=execute_add, write=write_result, functional=step_add))
+register_op(OpHandler("ADDI", [["rs1", "j"]], dest="rd", execute=execute_addi, write=write_result, functional=step_addi))
+register_op(OpHandler("NEG", [["rs1", "j"]], dest="rd", execute=execute_neg, write=write_result, functional=step_neg))
+register_op(OpHandler("NAND", [["rs1", "j"], ["rs2", "k"]], dest="rd", execute=execute_nand, write=write_result, functional=step_nand))
+register_op(OpHandler("SLL", [["rs1", "j"], ["rs2", "k"]], dest="rd", execute=execute_sll, write=write_result, functional=step_sll))
+
+
+class FunctionalSim:
+    # ISA-level interpreter over the same RegFile / Memory semantics as Tomasulo, with no stations
+    # and no cycle accounting. Used to fast-forward to the interesting part of a program.
+    def __init__(self, instructions, RegFile=None, memory=None, pc=0):
+        self.program = instructions if isinstance(instructions, InstructionSource) else InstructionSource(instructions)
+        if RegFile == None:
+            RegFile = {"R0": 0, "R1": 1, "R2": 2, "R3": 3, "R4": 4, "R5": 5, "R6": 6, "R7": 7}
+        self.RegFile = RegFile
+        self.memory = memory if memory != None else Memory()
+        self.pc = pc
+        self.retired = 0
+
+    def set_reg(self, reg, value):
+        if (reg != "R0"): # R0 is hardwired to zero
+            self.RegFile[reg] = value
+
+    def run(self, max_instructions=None, until_pc=None):
+        # Execute until the program ends, max_instructions have run, or the pc reaches until_pc.
+        # Returns the number of instructions executed by this call.
+        program = self.program
+        pc = self.pc
+        count = 0
+        while max_instructions == None or count < max_instructions:
+            instruction = program.get(pc)
+            if instruction == None: # ran off the program
+                break
+            pc = instruction.handler.functional(self, instruction, pc)
+            count += 1
+            if pc == until_pc:
+                break
+        self.pc = pc
+        self.retired += count
+        return count
+
+    def trace(self, max_instructions=None):
+        # Runs like run(), yielding the dynamic trace: every executed instruction's dict plus its "pc", in
+        # execution order, for Tomasulo(trace_driven=True)
+        count = 0
+        while max_instructions == None or count < max_instructions:
+            instruction = self.program.get(self.pc)
+            if instruction == None:
+                break
+            yield dict(instruction.source, pc=self.pc)
+            self.pc = instruction.handler.functional(self, instruction, self.pc)
+            self.retired += 1
+            count += 1
+
+
+class NotTakenPredictor:
+    # Static: always fall through
+    def predict(self, pc):
+        return None
+
+    def update(self, pc, taken, target):
+        return
+
+class BimodalPredictor:
+    # Branch target buffer plus a 2-bit saturating counter per entry, both indexed by pc.
+    # Counters start weakly not-taken; a taken prediction needs a BTB hit for the target.
+    def __init__(self, entries=256):
+        self.entries = entries
+        self.counters = [1] * entries
+        self.btb = [None] * entries # [pc, target]
+
+    def index(self, pc):
+        return pc % self.entries
+
+    def predict(self, pc):
+        if self.counters[self.index(pc)] < 2:
+            return None
+        entry = self.btb[pc % self.entries]
+        if entry != None and entry[0] == pc:
+            return entry[1]
+        return None
+
+    def update(self, pc, taken, target):
+        i = self.index(pc)
+        if taken == True:
+            self.counters[i] = min(3, self.counters[i] + 1)
+            self.btb[pc % self.entries] = [pc, target]
+        else:
+            self.counters[i] = max(0, self.counters[i] - 1)
+
+class GsharePredictor(BimodalPredictor):
+    # Counters indexed by pc xor the global outcome history. The history is updated when a branch
+    # resolves (in order), not at prediction time.
+    def __init__(self, entries=256, history_bits=8):
+        super().__init__(entries)
+        self.history_bits = history_bits
+        self.history = 0
+
+    def index(self, pc):
+        return (pc ^ self.history) % self.entries
+
+    def update(self, pc, taken, target):
+        super().update(pc, taken, target)
+        self.history = ((self.history << 1) | (1 if taken == True else 0)) & ((1 << self.history_bits) - 1)
+
+PREDICTORS = {"not_taken": NotTakenPredictor, "bimodal": BimodalPredictor, "gshare": GsharePredictor}
+
+class RunResult:
+    # Metrics of a run, built from the simulator's counters by Tomasulo.result()
+    def __init__(self, sim):
+        cycles = sim.clock_cycles
+        self.clock_cycles = cycles
+        self.issued = sim.issued_count
+        self.flushed = sim.flushed_count
+        self.instructions = sim.issued_count - sim.flushed_count # issued and not flushed
+        self.ipc = self.instructions / cycles if cycles > 0 else 0.0
+        self.finished = sim.finished
+        self.stall_cycles = sim.stall_cycles
+        self.stalls = dict(zip(STALL_NAMES, sim.stall_counts))
+        self.cdb_conflicts = sim.cdb_conflicts
+        self.fu_conflicts = sim.fu_conflicts
+        self.branches = sim.branch_count
+        self.mispredictions = sim.mispredictions
+        self.accuracy = 1 - sim.mispredictions / sim.branch_count if sim.branch_count > 0 else None
+        station_cycles = list(sim.station_cycles)
+        for station in sim.stations: # stations still in flight when the run paused
+            if station.busy == True:
+                station_cycles[station.opcode] += cycles - station.issue_cycle + 1
+        # Occupancy: average fraction of a type's stations that are busy. Utilization: fraction of
+        # its functional units' cycles spent executing (one unit per station), or with unit pools
+        # the fraction of cycles their units could not take a new operation
+        self.occupancy = {}
+        self.utilization = {}
+        for opcode, inst in enumerate(sim.inst_types):
+            capacity = len(sim.rs[inst]) * cycles
+            units = capacity if sim.num_fus == None else sim.num_fus[inst] * cycles
+            self.occupancy[inst] = station_cycles[opcode] / capacity if capacity > 0 else 0.0
+            self.utilization[inst] = sim.unit_cycles[opcode] / units if units > 0 else 0.0
+
+    @staticmethod
+    def columns(inst_types=INST_TYPES):
+        return (["clock_cycles", "instructions", "issued", "flushed", "ipc", "stall_cycles"]
+                + ["stall_" + name for name in STALL_NAMES]
+                + ["cdb_conflicts", "fu_conflicts", "branches", "mispredictions", "accuracy"]
+                + ["occupancy_" + inst for inst in inst_types] + ["utilization_" + inst for inst in inst_types])
+
+    def as_dict(self):
+        # Flat row, in columns() order
+        row = {"clock_cycles": self.clock_cycles, "instructions": self.instructions, "issued": self.issued,
+               "flushed": self.flushed, "ipc": self.ipc, "stall_cycles": self.stall_cycles}
+        for name in STALL_NAMES:
+            row["stall_" + name] = self.stalls[name]
+        row["cdb_conflicts"] = self.cdb_conflicts
+        row["fu_conflicts"] = self.fu_conflicts
+        row["branches"] = self.branches
+        row["mispredictions"] = self.mispredictions
+        row["accuracy"] = self.accuracy
+        for inst in self.occupancy:
+            row["occupancy_" + inst] = self.occupancy[inst]
+        for inst in self.utilization:
+            row["utilization_" + inst] = self.utilization[inst]
+        return row
+
+    def __repr__(self):
+        return f"RunResult(clock_cycles={self.clock_cycles}, instructions={self.instructions}, ipc={self.ipc:.3f})"
+
+# Bump when an engine change alters the results of a run, so stale cache entries are not reused
+RESULT_CACHE_VERSION = 1
+DEFAULT_RESULT_CACHE_DIR = os.path.join(os.environ.get("TOMASULO_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "tomasulo")),
+                                        "results")
+
+class ResultCache:
+    # On-disk cache of finished runs: the key is a hash of the simulator's complete state when run() starts
+    # (program, configuration, RegFile, memory, predictor), the value the checkpoint of its final state.
+    # Entries are files whose mtime is their last use; past max_bytes the least recently used go first.
+    def __init__(self, cache_dir=DEFAULT_RESULT_CACHE_DIR, max_bytes=256 << 20):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.size = None # bytes on disk, counted on the first put
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, sim):
+        state = sim.capture()
+        return hashlib.sha256(pickle.dumps([RESULT_CACHE_VERSION, state], pickle.HIGHEST_PROTOCOL)).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.run")
+
+    def get(self, key):
+        try:
+            with open(self.path(key), "rb") as f:
+                data = f.read()
+            os.utime(self.path(key)) # most recently used
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        # An unusable cache directory only means the run is not cached, its result is still returned
+        if write_cache_file(self.path(key), data) == False:
+            return
+        if self.size == None:
+            self.size = sum(size for [mtime, size, path] in self.entries())
+        else:
+            self.size += len(data)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        # [last use, bytes, path] of every entry, none if the directory cannot be read
+        entries = []
+        try:
+            scan = list(os.scandir(self.cache_dir))
+        except OSError:
+            return entries
+        for entry in scan:
+            if entry.name.endswith(".run"):
+                try:
+                    stat = entry.stat()
+                except OSError: # evicted by another process meanwhile
+                    continue
+                entries.append([stat.st_mtime, stat.st_size, entry.path])
+        return entries
+
+    def evict(self):
+        # Least recently used first, down to 3/4 of max_bytes so the next puts do not all evict again
+        entries = sorted(self.entries())
+        self.size = sum(size for [mtime, size, path] in entries)
+        for [mtime, size, path] in entries:
+            if self.size <= self.max_bytes * 3 // 4:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.size -= size
+
+    def clear(self):
+        for [mtime, size, path] in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.size = 0
+
+def check_config(ops, num_rs, instruction_cycles, num_cdb=1, rob_size=None, issue_width=1, fetch_width=None, iq_size=None):
+    # ValueError for a machine that could never finish a program using ops (op names): without these
+    # checks it would stall forever instead of failing
+    for inst in ops:
+        if num_rs.get(inst, 0) < 1:
+            raise ValueError(f"{inst} needs at least one reservation station")
+        if inst not in instruction_cycles:
+            raise ValueError(f"No execution cycles given for {inst}")
+    for inst in num_rs:
+        if num_rs[inst] < 0:
+            raise ValueError(f"Reservation stations of {inst} cannot be negative, got {num_rs[inst]}")
+    for inst in instruction_cycles:
+        if instruction_cycles[inst] < 1:
+            raise ValueError(f"Execution cycles of {inst} must be at least 1, got {instruction_cycles[inst]}")
+    if num_cdb < 1:
+        raise ValueError(f"num_cdb must be at least 1, got {num_cdb}")
+    if rob_size != None and rob_size < 1:
+        raise ValueError(f"rob_size must be at least 1, got {rob_size}")
+    for [name, width] in [["issue_width", issue_width], ["fetch_width", fetch_width], ["iq_size", iq_size]]:
+        if width != None and width < 1:
+            raise ValueError(f"{name} must be at least 1, got {width}")
 
 class Tomasulo:
-    def __init__(self, instructions, num_rs, instruction_cycles):
-        self.inst_types = ["LOAD", "STORE", "BNE", "JAL",
-                           "RET", "ADD", "ADDI", "NEG", "NAND", "SLL"]
-        self.instructions = instructions
+    def __init__(self, instructions, num_rs, instruction_cycles, event_driven=False, trace_level=TRACE_FULL, trace_sink=None,
+                 memory_capacity=128 * 1024, word_size=4, memory_image=None, num_cdb=1, issue_width=1,
+                 fetch_width=None, iq_size=None, predictor="not_taken", max_branches=4, rob_size=None,
+                 commit_width=None, num_phys_regs=None, num_fus=None, initiation_interval=None, result_cache=None,
+                 profile=None, trace_driven=False):
+        self.inst_types = list(INST_TYPES)
+        self.handlers = [OP_HANDLERS[inst] for inst in self.inst_types] # indexed by opcode
+        # Pre-decoded program: the handler of every instruction is looked up once, when it is read. A list is
+        # read here; a generator, file or InstructionSource streams, and then the checkpoints hold no program
+        self.instructions = instructions if isinstance(instructions, (list, tuple)) else None
+        self.program = instructions if isinstance(instructions, InstructionSource) else InstructionSource(instructions)
+        # A streamed program's ops are only known as it is read
+        ops = set(instruction.op for instruction in self.program.window) if self.program.iterator == None else set()
+        check_config(ops, num_rs, instruction_cycles, num_cdb, rob_size, issue_width, fetch_width, iq_size)
         self.instuction_cycles = instruction_cycles
-        self.cdb = True
+        # Common data buses: self.cdb counts the ones still free in the current cycle
+        self.num_cdb = num_cdb
+        self.cdb = num_cdb
         self.num_rs = num_rs
         self.clock_cycles = 0
+        # Tracing: the level is copied to an int so the hot loop only pays a comparison when it is off
+        self.tracer = Tracer(trace_level, trace_sink)
+        self.trace_level = trace_level
+        # Event-driven clock: jump over cycles where stations only count down
+        self.event_driven = event_driven
+        self.completions = [] # heap of [done_cycle, tag] for stations in execution
+        self.active = [] # stations that executed in the current cycle
+        self.progress = False # anything besides a countdown happened in the current cycle
+        # Counters for sweeps
+        self.issued_count = 0 # instructions issued
+        self.stall_cycles = 0 # cycles where an instruction was waiting but could not issue
+        self.fast_forwarded = 0 # instructions run by the functional model instead
+        self.flushed_count = 0 # issued instructions flushed by a taken branch
+        self.stall_counts = [0] * len(STALL_NAMES) # stall cycles by STALL_* reason
+        self.stall_reason = None # reason of the last failed issue
+        self.cdb_conflicts = 0 # writes turned away because the CDB was taken
+        self.fu_conflicts = 0 # station cycles spent ready but waiting for a functional unit
+        self.issue_until = None # run(issue_limit=N): stop issuing once issued_count reaches this, then drain
+        self.finished = False
+        # Periodic checkpoints taken by run(checkpoint_every=N), sorted by cycle
+        self.checkpoints = []
+        self.checkpoint_cycles = []
         # self.executed_cycles = 0
-        self.glob_pc = 0
+        self.glob_pc = 0 # pc of the next instruction to issue
+        # Front end: fetch puts up to fetch_width instructions per cycle in the instruction queue,
+        # issue takes up to issue_width from its head, in order
+        self.issue_width = issue_width
+        self.fetch_width = fetch_width if fetch_width != None else issue_width
+        self.iq_size = iq_size if iq_size != None else 2 * self.issue_width
+        self.iq = collections.deque() # [pc, instruction, predicted target or None], the head is at glob_pc
+        self.fetch_pc = 0 # pc of the next instruction to fetch
         self.RegFile = {
             "R0": 0,
             "R1": 1,
@@ -66,64 +975,43 @@ class Tomasulo:
             "R6": 6,
             "R7": 7
         }
-        self.flush = False
-        word_size = 4  # size in bytes
-        address_size = 16  # address in bits
-        memory_capacity = 128 * 1024  # Memory capacity in bytes
-        # num_words = memory_capacity // word_size  # Number of words in the memory
-        num_words = 5
-        # Create a list of words in the memory, initialized with zeros
-        self.memory = [0] * num_words
+        # Byte-addressable memory (128 KB of 4-byte words by default), initialized with zeros
+        # or with a binary image file
+        self.memory = Memory(memory_capacity, word_size)
+        if memory_image != None:
+            self.memory.load_image(memory_image)
         
-        #branch queue
-        self.branch_queue = []
-        self.branch_issued = False
+        # Branch prediction: a PREDICTORS name or a predictor object with predict(pc) / update(pc, taken, target)
+        self.predictor = PREDICTORS[predictor]() if isinstance(predictor, str) else predictor
+        self.max_branches = max_branches
+        self.unresolved = collections.deque() # seq of every unresolved branch, oldest first
+        self.branch_count = 0 # resolved branches
+        self.mispredictions = 0
+        # Optional reorder buffer (rob_size entries). With it results, stores and pc changes only become
+        # architectural when they commit in order, so JAL / RET are predicted instead of stalling issue.
+        self.rob_size = rob_size
+        self.commit_width = commit_width if commit_width != None else self.issue_width
+        self.rob = collections.deque() if rob_size != None else None
+        self.rob_lookup = {} # seq -> RobEntry
+        self.spec_regs = {} # register -> youngest written but uncommitted RobEntry for it
+        self.ras = [] # return address stack used by fetch
+        self.commit_ras = [] # the same stack as of the last committed instruction, restored on a flush
+        # Load-store queue: every LOAD until it reads, every STORE until its value is in memory
+        self.load_queue = AddressQueue()
+        self.store_queue = AddressQueue()
         
         #jal
         self.jal_issued = False
        
-        self.rs = {
-            "LOAD": [None] * num_rs["LOAD"],
-            "STORE": [None] * num_rs["STORE"],
-            "BNE": [None] * num_rs["BNE"],
-            "JAL": [None] * num_rs["JAL"],
-            "RET": [None] * num_rs["RET"],
-            "ADD": [None] * num_rs["ADD"],
-            "ADDI": [None] * num_rs["ADDI"],
-            "NEG": [None] * num_rs["NEG"],
-            "NAND": [None] * num_rs["NAND"],
-            "SLL": [None] * num_rs["SLL"]
-        }
-        # Set up the array of reservation stations for each instruction type
-        for i in range(self.num_rs["LOAD"]):
-            self.rs["LOAD"][i] = ReservationStation(i, f"LOAD{i+1}", "LOAD")
-
-        for i in range(self.num_rs["STORE"]):
-            self.rs["STORE"][i] = ReservationStation(i, f"STORE{i+1}", "STORE")
-
-        for i in range(self.num_rs["BNE"]):
-            self.rs["BNE"][i] = ReservationStation(i, f"BNE{i+1}", "BNE")
-
-        for i in range(self.num_rs["JAL"]):
-            self.rs["JAL"][i] = ReservationStation(i, f"JAL{i+1}", "JAL")
-
-        for i in range(self.num_rs["RET"]):
-            self.rs["RET"][i] = ReservationStation(i, f"RET{i+1}", "RET")
-
-        for i in range(self.num_rs["ADD"]):
-            self.rs["ADD"][i] = ReservationStation(i, f"ADD{i+1}", "ADD")
-
-        for i in range(self.num_rs["ADDI"]):
-            self.rs["ADDI"][i] = ReservationStation(i, f"ADDI{i+1}", "ADDI")
-
-        for i in range(self.num_rs["NEG"]):
-            self.rs["NEG"][i] = ReservationStation(i, f"NEG{i+1}", "NEG")
-
-        for i in range(self.num_rs["NAND"]):
-            self.rs["NAND"][i] = ReservationStation(i, f"NAND{i+1}", "NAND")
-
-        for i in range(self.num_rs["SLL"]):
-            self.rs["SLL"][i] = ReservationStation(i, f"SLL{i+1}", "SLL")
+        # Types left out of num_rs get no stations; check_config / issue raise if the program uses one
+        self.rs = {inst: [None] * self.num_rs.get(inst, 0) for inst in self.inst_types}
+        # Set up the array of reservation stations for each instruction type. Every station is also
+        # in the flat stations pool, and its tag is its position there
+        self.stations = []
+        for inst in self.inst_types:
+            for i in range(len(self.rs[inst])):
+                self.rs[inst][i] = ReservationStation(i, f"{inst}{i+1}", inst, tag=len(self.stations))
+                self.stations.append(self.rs[inst][i])
 
         # Status has the register name as key and its corresponding Qi --> set initially as none
         self.register_stat = {
@@ -136,413 +1024,487 @@ class Tomasulo:
             "R6": None,
             "R7": None
         }
+        # Optional register renaming onto num_phys_regs physical registers. Replaces register_stat:
+        # a source reads its physical register, or waits on the tag of the station that writes it
+        self.num_phys_regs = num_phys_regs
+        self.rename_map = None
+        if num_phys_regs != None:
+            if num_phys_regs <= len(self.RegFile):
+                raise ValueError(f"num_phys_regs must be more than the {len(self.RegFile)} architectural registers")
+            self.reset_rename()
+        # Stations waiting on each producer tag as [station, "j"/"k"] pairs, filled at issue
+        self.consumers = [[] for station in self.stations]
+        # Destination register of each producer tag, so a write does not scan register_stat
+        self.tag_dest = [None] * len(self.stations)
+        # Ready list per functional unit (by opcode): indexes of stations whose operands have all arrived
+        self.ready = [set() for inst in self.inst_types]
+        # Stations that finished executing, as a heap of [seq, tag] so the oldest writes first
+        self.write_queue = []
+        self.issue_seq = 0 # seq of the next issued instruction
+        # Per type (by opcode): cycles its stations were busy, and cycles its units spent executing
+        self.station_cycles = [0] * len(self.inst_types)
+        self.unit_cycles = [0] * len(self.inst_types)
+        # Optional functional unit pools. By default every station is its own unit; with num_fus a type
+        # has that many units (types left out keep one per station), each able to start a new operation
+        # every initiation_interval cycles (1: fully pipelined, the latency: not pipelined at all)
+        self.num_fus = None
+        self.fu_free = None
+        if num_fus != None:
+            self.num_fus = {inst: num_fus.get(inst, len(self.rs[inst])) for inst in self.inst_types}
+            intervals = initiation_interval if initiation_interval != None else {}
+            self.initiation_interval = {inst: intervals.get(inst, 1) for inst in self.inst_types}
+            for inst in self.inst_types:
+                if self.num_fus[inst] < 1 and len(self.rs[inst]) > 0:
+                    raise ValueError(f"{inst} needs at least one functional unit, got {self.num_fus[inst]}")
+                if self.initiation_interval[inst] < 1:
+                    raise ValueError(f"Initiation interval of {inst} must be at least 1, got {self.initiation_interval[inst]}")
+            self.fu_free = [[0] * self.num_fus[inst] for inst in self.inst_types] # per unit: first cycle it takes a new operation
+        self.unit_wait = None # earliest cycle a unit frees up for a station turned away in the current cycle
+        self.unit_waiting = 0 # stations turned away in the current cycle
+        # Dynamic trace: control ops take their outcome from the next record instead of redirecting fetch
+        self.trace_driven = trace_driven
+        # Optional ResultCache: a run from cycle 0 whose starting state was simulated before restores its end state
+        self.result_cache = result_cache
+        # Optional Profiler (profile=True for a default one): host time per stage and op, printed when the run ends
+        self.profiler = Profiler() if profile == True else profile if profile != False else None
+        if self.profiler != None:
+            self.profiler.attach(self)
+
+    def reset_rename(self):
+        # Nothing in flight: Ri maps to physical register i, which holds RegFile's value
+        registers = list(self.RegFile)
+        self.rename_map = {reg: phys for phys, reg in enumerate(registers)}
+        self.commit_map = dict(self.rename_map) # with a ROB: the mapping as of the last committed instruction
+        self.phys_regs = [self.RegFile[reg] for reg in registers] + [0] * (self.num_phys_regs - len(registers))
+        self.phys_tag = [None] * self.num_phys_regs # producer station tag, None once the value is there
+        self.free_list = collections.deque(range(len(registers), self.num_phys_regs))
+        self.rename_snapshots = {} # without a ROB: branch seq -> rename_map right after it issued
+
+    def rename(self, station, rd):
+        phys = self.free_list.popleft()
+        station.phys = phys
+        station.prev_phys = self.rename_map[rd]
+        self.rename_map[rd] = phys
+        self.phys_tag[phys] = station.tag
+
+    def free_phys(self, phys):
+        self.phys_tag[phys] = None # a late write from an older producer is dropped
+        self.free_list.append(phys)
+
+    def write_phys(self, station, reg):
+        # Renamed broadcast: the physical register, then the ROB entry or (if still mapped) RegFile
+        if self.phys_tag[station.phys] == station.tag:
+            self.phys_regs[station.phys] = station.result
+            self.phys_tag[station.phys] = None
+        if self.rob != None:
+            self.rob_lookup[station.seq].value = station.result
+            return
+        if self.rename_map[reg] == station.phys:
+            self.RegFile[reg] = station.result
+        # Writes wait for older branches, so no flush can map rd back to the previous register now
+        self.free_phys(station.prev_phys)
+
+    def recover_rename(self, seq):
+        # Mapping as it was right after seq issued
+        if self.rob != None: # a ROB flush empties everything in flight: the committed mapping
+            self.rename_map = dict(self.commit_map)
+            live = set(self.commit_map.values())
+            self.free_list = collections.deque(phys for phys in range(self.num_phys_regs) if phys not in live)
+            self.phys_tag = [None] * self.num_phys_regs
+            return
+        self.rename_map = self.rename_snapshots[seq]
+        for branch in [branch for branch in self.rename_snapshots if branch >= seq]:
+            del self.rename_snapshots[branch]
+        for reg, phys in self.rename_map.items(): # values the squashed writers had hidden
+            if self.phys_tag[phys] == None:
+                self.RegFile[reg] = self.phys_regs[phys]
 
     def fill_qj(self, operation, r, rs1):
-        if (self.register_stat[rs1] != None):
+        if self.rename_map != None:
+            phys = self.rename_map[rs1]
+            self.rs[operation][r].qj = self.phys_tag[phys]
+            if self.phys_tag[phys] != None:
+                self.consumers[self.phys_tag[phys]].append([self.rs[operation][r], "j"])
+            else:
+                self.rs[operation][r].vj = self.phys_regs[phys]
+        elif (self.register_stat[rs1] != None):
             self.rs[operation][r].qj = self.register_stat.get(rs1)
+            self.consumers[self.rs[operation][r].qj].append([self.rs[operation][r], "j"])
+        elif rs1 in self.spec_regs:
+            self.rs[operation][r].vj = self.spec_regs[rs1].value
+            self.rs[operation][r].qj = None
         else:
             self.rs[operation][r].vj = self.RegFile[rs1]
             self.rs[operation][r].qj = None
         return
 
     def fill_qk(self, operation, r, rs2):
-        if (self.register_stat[rs2] != None):
+        if self.rename_map != None:
+            phys = self.rename_map[rs2]
+            self.rs[operation][r].qk = self.phys_tag[phys]
+            if self.phys_tag[phys] != None:
+                self.consumers[self.phys_tag[phys]].append([self.rs[operation][r], "k"])
+            else:
+                self.rs[operation][r].vk = self.phys_regs[phys]
+        elif (self.register_stat[rs2] != None):
             self.rs[operation][r].qk = self.register_stat.get(rs2)
+            self.consumers[self.rs[operation][r].qk].append([self.rs[operation][r], "k"])
+        elif rs2 in self.spec_regs:
+            self.rs[operation][r].vk = self.spec_regs[rs2].value
+            self.rs[operation][r].qk = None
         else:
             self.rs[operation][r].vk = self.RegFile[rs2]
             self.rs[operation][r].qk = None
         return
 
+    def mark_ready(self, operation, r):
+        # Put the station on its unit's ready list once its last operand is available
+        station = self.rs[operation][r]
+        if station.busy == False or station.executed == True:
+            return
+        for dep in self.handlers[station.opcode].deps:
+            if (dep == "j" and station.qj != None) or (dep == "k" and station.qk != None):
+                return
+        self.ready[station.opcode].add(r)
+
     def fetch(self, pc):
         # if (self.flush == True):
         #     self.flush = False
         #     return None
         
-        if pc < len(self.instructions):
-            print("Fetched instruction with ")
-            return self.instructions[pc]
+        instruction = self.program.get(pc)
+        if instruction != None:
+            if self.trace_level >= TRACE_EVENTS:
+                self.tracer.log("Fetched instruction with ")
+            return instruction
         
-    def issue(self, instruction, pc):
+    def issue(self, instruction, pc, prediction=None):
         # For Tracing Purposes
         # print("\nInstruction: ", instruction.get("op"), instruction.get(
             # "rd"), instruction.get("rs1"), instruction.get("rs2"), "\n")
-        print("Issue Stage of clock cycle: ", self.clock_cycles)
-        if self.jal_issued == True: #stall for jal
+        if self.trace_level >= TRACE_EVENTS:
+            self.tracer.log("Issue Stage of clock cycle: ", self.clock_cycles)
+        if self.jal_issued == True: #stall for jal / ret
+            self.stall_reason = STALL_JAL
             return False
-        
-        
-        operation = instruction.get("op")
-        for [op, index] in self.branch_queue:
-            if pc == self.rs[op][index].pc:
-                print("I am stalling in clock cycle: ", self.clock_cycles, " because of branch")
-                return True
+        if self.rob != None and len(self.rob) >= self.rob_size:
+            self.stall_reason = STALL_ROB_FULL
+            return False
+        if isinstance(instruction, dict):
+            instruction = DecodedInstruction(instruction)
 
-        if operation == "LOAD":
-            rs1 = instruction.get("rs1")
-            rd = instruction.get("rd")
-            if self.register_stat[rd] != None:
-                return False
-            for r in range(self.num_rs[operation]):
-                if self.rs[operation][r].busy is False:
-                    self.fill_qj(operation, r, rs1)
-                    self.rs[operation][r].rd = rd
-                    self.register_stat[rd] = self.rs[operation][r].name
-                    self.rs[operation][r].A = instruction.get("imm")
-                    self.rs[operation][r].busy = True
-                    self.rs[operation][r].total_ex_cycles = self.instuction_cycles[operation]
-                    self.rs[operation][r].issue_cycle = self.clock_cycles
-                    self.rs[operation][r].pc = pc
-                    print("I was issued in clock cycle: ", self.clock_cycles, ", OPERATION: ", operation)
-                    if (self.branch_issued == True):
-                        self.branch_queue.append([operation, r])
-                    return True
-
-        elif operation == "STORE":
-            rs1 = instruction.get("rs1")
-            rs2 = instruction.get("rs2")
-            for r in range(self.num_rs[operation]):
-                if self.rs[operation][r].busy is False:
-                    self.fill_qj(operation, r, rs1)
-                    self.fill_qk(operation, r, rs2)
-                    self.rs[operation][r].A = instruction.get("imm")
-                    self.rs[operation][r].busy = True
-                    self.rs[operation][r].total_ex_cycles = self.instuction_cycles[operation]
-                    self.rs[operation][r].issue_cycle = self.clock_cycles
-                    self.rs[operation][r].pc = pc
-                    print("I was issued in clock cycle: ", self.clock_cycles, " , OPERATION: ", operation)
-                    if (self.branch_issued == True):
-                        self.branch_queue.append([operation, r])
-                    return True
-        
-        elif operation == "BNE":
-            rs1 = instruction.get("rs1")
-            rs2 = instruction.get("rs2")
-            # Fill in A, rs1, rs2, pc
-            for r in range(self.num_rs[operation]):
-                if self.rs[operation][r].busy is False:
-                    self.fill_qj(operation, r, rs1)
-                    self.fill_qk(operation, r, rs2)
-                    self.rs[operation][r].A = instruction.get("imm") #NOT PRESENT YET #LABEL imm
-                    self.rs[operation][r].pc = pc
-                    self.rs[operation][r].busy = True
-                    self.rs[operation][r].total_ex_cycles = self.instuction_cycles[operation]
-                    self.rs[operation][r].issue_cycle = self.clock_cycles
-                    print("I was issued in clock cycle: ", self.clock_cycles, ", OPERATION: ", operation)
-                    self.branch_issued = True
-                    # if (self.branch_issued == True):
-                    #     self.branch_queue.append([operation, r])
-                    return True
-                   
-        elif operation == "JAL":
-            if self.register_stat["R1"] != None:
-                return False
-            for r in range(self.num_rs[operation]):
-                if self.rs[operation][r].busy is False:
-                    # Fill in A
-                    self.rs[operation][r].A = instruction.get("imm")
-                    self.rs[operation][r].pc = pc
-                    self.rs[operation][r].rd = "R1"
-                    self.register_stat["R1"] = self.rs[operation][r].name
-                    self.rs[operation][r].busy = True
-                    self.rs[operation][r].total_ex_cycles = self.instuction_cycles[operation]
-                    self.rs[operation][r].issue_cycle = self.clock_cycles
+        handler = instruction.handler
+        if handler.branch == True and self.rob == None and len(self.unresolved) >= self.max_branches:
+            if self.trace_level >= TRACE_EVENTS:
+                self.tracer.log("I am stalling in clock cycle: ", self.clock_cycles, " because of branch")
+            self.stall_reason = STALL_BRANCH
+            return False
+        operation = instruction.op
+        rd = handler.dest
+        if rd == "rd":
+            rd = instruction.rd
+        if rd == "R0": # R0 is hardwired to zero: never renamed, the result is dropped
+            rd = None
+        if rd != None and self.rename_map == None and self.register_stat[rd] != None: # WAW
+            self.stall_reason = STALL_WAW
+            return False
+        if rd != None and self.rename_map != None and len(self.free_list) == 0:
+            self.stall_reason = STALL_RENAME
+            return False
+        for r in range(len(self.rs[operation])):
+            if self.rs[operation][r].busy is False:
+                station = self.rs[operation][r]
+                for [field, operand] in handler.sources:
+                    reg = field if field in self.RegFile else getattr(instruction, field)
+                    if operand == "j":
+                        self.fill_qj(operation, r, reg)
+                    else:
+                        self.fill_qk(operation, r, reg)
+                if rd != None:
+                    station.rd = rd
+                    self.tag_dest[station.tag] = rd
+                    if self.rename_map != None:
+                        self.rename(station, rd)
+                    else:
+                        self.register_stat[rd] = station.tag
+                station.A = instruction.imm
+                station.pc = pc
+                station.busy = True
+                station.total_ex_cycles = self.instuction_cycles[operation]
+                station.issue_cycle = self.clock_cycles
+                station.seq = self.issue_seq
+                self.issue_seq += 1
+                if handler.memory != None:
+                    self.address_queue(handler).add(station.seq, station.tag)
+                if self.trace_level >= TRACE_EVENTS:
+                    self.tracer.log("I was issued in clock cycle: ", self.clock_cycles, ", OPERATION: ", operation)
+                if handler.branch == True:
+                    station.prediction = prediction
+                if self.rob != None:
+                    entry = RobEntry(station.seq, operation, pc, rd, prediction if prediction != None else pc + 1)
+                    entry.phys = station.phys
+                    entry.prev_phys = station.prev_phys
+                    self.rob.append(entry)
+                    self.rob_lookup[station.seq] = entry
+                elif handler.branch == True:
+                    self.unresolved.append(station.seq)
+                    if self.rename_map != None:
+                        self.rename_snapshots[station.seq] = dict(self.rename_map)
+                elif handler.stalls_issue == True: #stall until execution is finished
                     self.jal_issued = True
-                    if (self.branch_issued == True):
-                        self.branch_queue.append([operation, r])
-                    #stall until execution is finished
-                    
-                    print("I was issued in clock cycle: ", self.clock_cycles, ", OPERATION: ", operation)
-                    return True
-                    
-            #stall until execution is finished  
-            return 
-                      
-        elif operation == "RET":
-            for r in range(self.num_rs[operation]):
-                if self.rs[operation][r].busy is False:
-                    self.rs[operation][r].pc = pc
-                    # self.rs[operation][r].rd = "R1"
-                    # self.register_stat["R1"] = self.rs[operation][r].name
-                    self.rs[operation][r].busy = True
-                    self.rs[operation][r].total_ex_cycles = self.instuction_cycles[operation]
-                    self.rs[operation][r].issue_cycle = self.clock_cycles
-                    # self.jal_issued = True
-                    if (self.branch_issued == True):
-                        self.branch_queue.append([operation, r])
-                    #stall until execution is finished
-                    
-                    print("I was issued in clock cycle: ", self.clock_cycles, ", OPERATION: ", operation)
-                    return True
-                    
-            #stall until execution is finished  
-            return
-
-        elif operation == "ADDI":
-            for r in range(self.num_rs[operation]):
-                rs1 = instruction.get("rs1")
-                rd = instruction.get("rd")
-                if self.register_stat[rd] != None:
-                    return False
-                if self.rs[operation][r].busy is False:
-                    self.fill_qj(operation, r, rs1)
-                    self.rs[operation][r].rd = rd
-                    self.register_stat[rd] = self.rs[operation][r].name
-                    self.rs[operation][r].busy = True
-                    self.rs[operation][r].pc = pc
-                    self.rs[operation][r].A = instruction.get("imm")
-                    self.rs[operation][r].total_ex_cycles = self.instuction_cycles[operation]
-                    # if (operation == "ADD"):
-                    print("I was issued in clock cycle: ", self.clock_cycles, ", OPERATION: ", operation)
-                    self.rs[operation][r].issue_cycle = self.clock_cycles
-                    if (self.branch_issued == True):
-                        self.branch_queue.append([operation, r])
-                    return True
-        
-        elif operation == "NEG":
-            for r in range(self.num_rs[operation]):
-                rs1 = instruction.get("rs1")
-                rd = instruction.get("rd")
-                if self.register_stat[rd] != None:
-                    return False
-                if self.rs[operation][r].busy is False:
-                    self.fill_qj(operation, r, rs1)
-                    self.rs[operation][r].rd = rd
-                    self.register_stat[rd] = self.rs[operation][r].name
-                    self.rs[operation][r].busy = True
-                    self.rs[operation][r].pc = pc
-                    self.rs[operation][r].total_ex_cycles = self.instuction_cycles[operation]
-                    self.rs[operation][r].issue_cycle = self.clock_cycles
-                    print("I was issued in clock cycle: ", self.clock_cycles, ", OPERATION: ", operation)
-                    if (self.branch_issued == True):
-                        self.branch_queue.append([operation, r])
-                    return True
-        
-        else: # ADD, NAND, & SLL
-            for r in range(self.num_rs[operation]):
-                rs1 = instruction.get("rs1")
-                rs2 = instruction.get("rs2")
-                rd = instruction.get("rd")
-                if self.register_stat[rd] != None:
-                    return False
-                if self.rs[operation][r].busy is False:
-                    self.fill_qj(operation, r, rs1)
-                    self.fill_qk(operation, r, rs2)
-                    self.rs[operation][r].rd = rd
-                    self.register_stat[rd] = self.rs[operation][r].name
-                    self.rs[operation][r].busy = True
-                    self.rs[operation][r].pc = pc
-                    self.rs[operation][r].total_ex_cycles = self.instuction_cycles[operation]
-                    self.rs[operation][r].issue_cycle = self.clock_cycles
-                    print("I was issued in clock cycle: ", self.clock_cycles, ", OPERATION: ", operation)
-                    if (self.branch_issued == True):
-                        self.branch_queue.append([operation, r])
-                    return True
+                self.mark_ready(operation, r)
+                return True
+        if len(self.rs[operation]) == 0: # only a streamed program gets here, a list is checked by check_config
+            raise ValueError(f"{operation} needs at least one reservation station")
+        self.stall_reason = STALL_RS_FULL
         return False
 
-    def execute_all(self):
-        print("Executing Stage of clock cycle: ", self.clock_cycles)
-        for inst in self.inst_types:
-            for i in range(self.num_rs[inst]):
-                # and self.rs[inst][i].total_ex_cycles > 1):
-                if (self.rs[inst][i].busy == True and self.rs[inst][i].executed == False):
-                    # print("Execution Cycle: ", self.rs[inst][i].total_ex_cycles)
-                    self.check_to_execute(self.rs[inst][i].op, i)
-                    # print("Execution Cycle: ", self.rs[inst][i].total_ex_cycles)
+    def redirect(self, pc):
+        # Continue fetching and issuing at pc; whatever was fetched on the old path is dropped
+        self.glob_pc = pc
+        self.fetch_pc = pc
+        self.iq.clear()
+
+    def predict(self, pc, instruction):
+        # Next pc guess for the instruction at pc, None to fall through
+        if self.trace_driven == True: # the next trace record is where it went
+            return None
+        handler = instruction.handler
+        if handler.branch == True:
+            return self.predictor.predict(pc)
+        if self.rob == None: # JAL / RET stall issue until they write
+            return None
+        if handler.call == True:
+            self.ras.append(pc + 1)
+            return pc + instruction.imm
+        if handler.returns == True and len(self.ras) > 0:
+            return self.ras.pop()
+        return None
+
+    def fetch_all(self):
+        fetched = 0
+        while fetched < self.fetch_width and len(self.iq) < self.iq_size and self.program.has(self.fetch_pc):
+            instruction = self.fetch(self.fetch_pc)
+            prediction = self.predict(self.fetch_pc, instruction)
+            self.iq.append([self.fetch_pc, instruction, prediction])
+            self.fetch_pc = prediction if prediction != None else self.fetch_pc + 1
+            fetched += 1
 
-                # elif (self.rs[inst][i].total_ex_cycles == 1):
-                #     self.execute(self.rs[inst][i].op, i)
+    def issue_all(self):
+        # Up to issue_width instructions from the queue head, stopping at the first one that stalls
+        issued = 0
+        while issued < self.issue_width and len(self.iq) > 0 and self.fetching() == True: #check if last instruction
+            [pc, instruction, prediction] = self.iq[0]
+            if self.trace_level >= TRACE_EVENTS:
+                self.tracer.log("Instruction: ", instruction)
+            if (self.issue(instruction, pc, prediction) == False): # issue or not issue --> stall
+                break
+            self.iq.popleft()
+            self.glob_pc = prediction if prediction != None else pc + 1
+            self.issued_count += 1
+            issued += 1
+        if issued > 0:
+            self.progress = True
+        elif self.fetching() == True:
+            self.stall_cycles += 1
+            self.stall_counts[self.stall_reason] += 1
 
-                # operation = self.rs[inst][i].op 
+    def execute_all(self):
+        if self.trace_level >= TRACE_EVENTS:
+            self.tracer.log("Executing Stage of clock cycle: ", self.clock_cycles)
+        # Only stations on a ready list can run; sorted keeps the original station order
+        for opcode, inst in enumerate(self.inst_types):
+            ready = sorted(self.ready[opcode])
+            if self.fu_free != None: # the oldest ready stations get the free units
+                ready.sort(key=lambda i: self.rs[inst][i].seq)
+            for i in ready:
+                # a BNE flush earlier in this cycle may have emptied the station
+                if (self.rs[inst][i].busy == True and self.rs[inst][i].executed == False):
+                    self.check_to_execute(inst, i)
         return
 
     def check_to_execute(self, operation, i): ############# REMAINING JAL AND RET
         
         # print("************************************************************************************************")
         # print("PC is: ", self.glob_pc)
-        print("Instruction: ", operation, " ---  Issue Cycle: ", self.rs[operation][i].issue_cycle, " and clock cycles: ", self.clock_cycles)
+        if self.trace_level >= TRACE_EVENTS:
+            self.tracer.log("Instruction: ", operation, " ---  Issue Cycle: ", self.rs[operation][i].issue_cycle, " and clock cycles: ", self.clock_cycles)
         if self.rs[operation][i].total_ex_cycles <= 0:
             # if (operation == "ADD"):
-            print("Breaking out of the execute function")
+            if self.trace_level >= TRACE_EVENTS:
+                self.tracer.log("Breaking out of the execute function")
             return
         if self.rs[operation][i].issue_cycle >= self.clock_cycles:
             # if (operation == "ADD"):
-            print("Cannot issue and execute at the same time!!")
+            if self.trace_level >= TRACE_EVENTS:
+                self.tracer.log("Cannot issue and execute at the same time!!")
             return 
-        for [op, index] in self.branch_queue:
-            if operation == op and index == i and self.branch_issued == True:
-                return
-            
-        # if self.rs[operation][i].
-        # if self.branch_issued 
-        
-        if operation == "LOAD":
-            if (self.rs[operation][i].qj == None):  # && r is at the head of the load-store queue
-                self.rs[operation][i].A = self.rs[operation][i].vj + self.rs[operation][i].A
-                # self.RegFile[self.rs[operation][i].rd] = self.memory[self.rs[operation][i].A]
-                self.rs[operation][i].result = self.memory[self.rs[operation][i].A]
-                self.rs[operation][i].execute_cycle = self.clock_cycles
-                print("I am executing in cycle: ", self.clock_cycles, ", operation: ", operation)
-                self.rs[operation][i].total_ex_cycles -= 1
-                self.compute_result(self.rs[operation][i].op, i)
-                # read from memory at address A
-                # Lec 18 Slide 6
-
-        elif (operation == "STORE"):
-            if (self.rs[operation][i].qj == None):  ##REMOVED --> NOT SAME CONDITION AS SLIDES QK IS EXTRAA # && r is at the head of the load-store queue
-                self.rs[operation][i].A = self.rs[operation][i].vj + self.rs[operation][i].A
-                self.rs[operation][i].execute_cycle = self.clock_cycles
-                print("I am executing in cycle: ", self.clock_cycles, ", operation: ", operation)
-                self.rs[operation][i].total_ex_cycles -= 1
-                self.compute_result(self.rs[operation][i].op, i)
-                # Lec 18 Slide 7.
-
-        elif (operation == "BNE"):
-            if (self.rs[operation][i].qj == None and self.rs[operation][i].qk == None):
-                self.rs[operation][i].total_ex_cycles -= 1
-                self.rs[operation][i].execute_cycle = self.clock_cycles
-                print("I am executing in cycle: ", self.clock_cycles, ", operation: ", operation)
-                self.compute_result(self.rs[operation][i].op, i)
-                print("This is the branch Queue: ")
-                for [op, index] in self.branch_queue:
-                    print("Op: ", op, " index: ", index)
-
-                if (self.flush == True and self.rs[operation][i].executed == True):
-                    self.flush_all(operation, i)
-                
-                    # self.branch_queue.clear()
-                
-        elif (operation == "JAL" or operation == "RET"):
-                self.rs[operation][i].total_ex_cycles -= 1
-                self.rs[operation][i].execute_cycle = self.clock_cycles
-                print("I am executing in cycle: ", self.clock_cycles, ", operation: ", operation)
-                self.compute_result(self.rs[operation][i].op, i)
-            
-
-        elif (operation == "ADDI"):
-            if (self.rs[operation][i].qj == None):
-                print("I am executing in cycle: ", self.clock_cycles, ", operation: ", operation)
-                self.rs[operation][i].execute_cycle = self.clock_cycles
-                self.rs[operation][i].total_ex_cycles -= 1
-                self.compute_result(self.rs[operation][i].op, i)
 
-        
-        else:
-            if (self.rs[operation][i].qj == None and self.rs[operation][i].qk == None):
-                print("I am executing in cycle: ", self.clock_cycles, ", operation: ", operation)
-                self.rs[operation][i].execute_cycle = self.clock_cycles
-                self.rs[operation][i].total_ex_cycles -= 1
-                self.compute_result(self.rs[operation][i].op, i)
-                
+        # Operands are already available: the station is only on the ready list once they arrive
+        station = self.rs[operation][i]
+        if self.fu_free != None and station.total_ex_cycles == self.instuction_cycles[operation] and self.claim_unit(station) == False:
+            return
+        if self.trace_level >= TRACE_EVENTS:
+            self.tracer.log("I am executing in cycle: ", self.clock_cycles, ", operation: ", operation)
+        station.execute_cycle = self.clock_cycles
+        handler = self.handlers[station.opcode]
+        try:
+            handler.execute(self, station)
+        except (IndexError, ValueError, TypeError) as e: # may be on a wrong path: only raised once it writes
+            station.fault = e
+        station.total_ex_cycles -= 1
+        if self.fu_free == None:
+            self.unit_cycles[station.opcode] += 1
+        if (station.total_ex_cycles == 0):
+            station.executed = True
+            self.progress = True
+            self.ready[station.opcode].discard(i) # finished: off the ready list
+            heapq.heappush(self.write_queue, [station.seq, station.tag])
+            if handler.complete != None:
+                handler.complete(self, station)
+
+        if self.event_driven == True:
+            self.track_execution(operation, i)
         return
 
-    def compute_result(self, operation, r):
-        # Set the executed bool of the rs to "True" here or before returning from the execute function
-        if (self.rs[operation][r].total_ex_cycles == 0):
-            self.rs[operation][r].executed = True        
-            if operation == "BNE":
-                self.branch_issued = False
-                # self.branch_queue.clear()
-    
-        if (operation == "ADD"):
-            self.rs[operation][r].result = self.rs[operation][r].vj + \
-                self.rs[operation][r].vk
-
-        elif (operation == "ADDI"):
-            self.rs[operation][r].result = self.rs[operation][r].vj + \
-                self.rs[operation][r].A
-
-        elif (operation == "NEG"):
-            self.rs[operation][r].result = -1 * self.rs[operation][r].vj
-
-        elif (operation == "NAND"):
-            self.rs[operation][r].result = ~(
-                self.rs[operation][r].vj & self.rs[operation][r].vk)
-
-        elif (operation == "SLL"):
-            self.rs[operation][r].result = self.rs[operation][r].vj << self.rs[operation][r].vk
-        
-        elif (operation == "JAL"):
-            self.rs[operation][r].result = self.rs[operation][r].A + self.rs[operation][r].pc
-            self.rs[operation][r].offset = self.rs[operation][r].pc + 1 #offset
-        
-        elif (operation == "RET"):
-            self.rs[operation][r].result = self.RegFile["R1"]
-            
-        elif (operation == "BNE"):
-            #  TO BE CONTINUED... FLUSHING NEEDED!
-            if (self.rs[operation][r].vj != self.rs[operation][r].vk): # branch taken
-                self.rs[operation][r].result = self.rs[operation][r].A + self.rs[operation][r].pc
-                self.flush = True
-            
-        # elif (operation == "RET"):
-        #     self.rs[operation][r].result = self.rs[operation][r].vj + self.rs[operation][r].A
-            
+    def claim_unit(self, station):
+        # First unit of the station's type that can start an operation this cycle; False if all are busy
+        units = self.fu_free[station.opcode]
+        for unit in range(len(units)):
+            if units[unit] <= self.clock_cycles:
+                interval = self.initiation_interval[station.op]
+                units[unit] = self.clock_cycles + interval
+                self.unit_cycles[station.opcode] += interval
+                return True
+        if self.trace_level >= TRACE_EVENTS:
+            self.tracer.log(station.name, " is waiting for a functional unit in clock cycle: ", self.clock_cycles)
+        self.fu_conflicts += 1
+        self.unit_waiting += 1
+        if self.unit_wait == None or min(units) < self.unit_wait:
+            self.unit_wait = min(units)
+        return False
+
+    def track_execution(self, operation, i):
+        # Remember who counted down this cycle and queue the cycle its execution ends in
+        station = self.rs[operation][i]
+        if station.executed == True:
+            return
+        self.active.append(station)
+        done = self.clock_cycles + station.total_ex_cycles
+        if station.done_cycle != done: # first cycle, or it was held back by a branch
+            station.done_cycle = done
+            heapq.heappush(self.completions, [done, station.tag])
+
+    def skip_idle_cycles(self, limit=None):
+        # Only a cycle with nothing but countdowns repeats itself until the next completion. Stale
+        # entries are dropped first either way, or a run that never idles would keep all of them
+        while len(self.completions) > 0:
+            [done, tag] = self.completions[0]
+            station = self.stations[tag]
+            if station.busy == True and station.executed == False and station.done_cycle == done and done > self.clock_cycles:
+                break
+            heapq.heappop(self.completions) # finished, emptied, or stalled by a branch
+            if station.done_cycle == done:
+                station.done_cycle = None
+        if self.progress == True or len(self.active) == 0 or len(self.completions) == 0:
+            return
+        skip = self.completions[0][0] - self.clock_cycles - 1
+        if self.unit_wait != None: # a waiting station starts once its unit frees up
+            skip = min(skip, self.unit_wait - self.clock_cycles - 1)
+        if limit != None: # do not jump over a requested stop or checkpoint cycle
+            skip = min(skip, limit - self.clock_cycles)
+        if skip <= 0:
+            return
+        if self.trace_level >= TRACE_EVENTS:
+            self.tracer.log("Skipping idle clock cycles ", self.clock_cycles + 1, " to ", self.clock_cycles + skip)
+        self.clock_cycles += skip
+        if self.fetching() == True: # the front end was stalled in every skipped cycle
+            self.stall_cycles += skip
+            self.stall_counts[self.stall_reason] += skip
+        for cycle in range(min(skip, self.iq_size)): # fetch kept filling the queue meanwhile
+            self.fetch_all()
+        self.fu_conflicts += skip * self.unit_waiting
+        for station in self.active:
+            station.total_ex_cycles -= skip
+            if self.fu_free == None:
+                self.unit_cycles[station.opcode] += skip
+            station.execute_cycle = self.clock_cycles
+
     def write_all(self):
-        print("Write Stage of clock cycle: ", self.clock_cycles)
-        for inst in self.inst_types:
-            for i in range(self.num_rs[inst]):
-                if (self.rs[inst][i].executed == True): #self.rs[inst][i] != None and 
-                    self.write(self.rs[inst][i].op, i)
+        if self.trace_level >= TRACE_EVENTS:
+            self.tracer.log("Write Stage of clock cycle: ", self.clock_cycles)
+        # Finished stations try to write oldest first; the ones that cannot write yet go back in the queue
+        waiting = []
+        while len(self.write_queue) > 0:
+            [seq, tag] = heapq.heappop(self.write_queue)
+            station = self.stations[tag]
+            if station.executed == False or station.seq != seq: # already written or flushed
+                continue
+            self.write(station.op, station.index)
+            if station.executed == True:
+                waiting.append([seq, tag])
+        for entry in waiting:
+            heapq.heappush(self.write_queue, entry)
         return
 
     def write(self, operation, i):
-        if self.rs[operation][i].execute_cycle >= self.clock_cycles:
-            print("Executed Cycle: ", self.rs[operation][i].execute_cycle, " Current Clock cycle: ", self.clock_cycles)
+        station = self.rs[operation][i]
+        if station.execute_cycle >= self.clock_cycles:
+            if self.trace_level >= TRACE_EVENTS:
+                self.tracer.log("Executed Cycle: ", station.execute_cycle, " Current Clock cycle: ", self.clock_cycles)
             return 
-        if operation == "JAL":
-            self.jal_issued = False
-            
-        if (self.cdb == False):
+        handler = self.handlers[station.opcode]
+        if len(self.unresolved) > 0 and station.seq > self.unresolved[0]: # speculative: wait for the branch
             return
-        if operation == "STORE":
-            if (self.rs[operation][i].qk == None):
-                self.memory[self.rs[operation][i].A] = self.rs[operation][i].vk
-                self.empty_entry(self.rs[operation][i])
-                print("I, ", operation, ", am writing in clock cycle: ", self.clock_cycles)
-
-        elif (operation == "BNE" or operation == "RET"):
-            self.glob_pc = self.rs[operation][i].result
-            
-            print("I, ", operation, ", am writing in clock cycle: ", self.clock_cycles, "New PC: ", self.glob_pc)
-            self.empty_entry(self.rs[operation][i])
-            self.cdb = False
+        if (self.cdb == 0):
+            self.cdb_conflicts += 1
             return
-        
-        # elif (operation == "RET"):
-            
-        
-        # elif (operation == "JAL"):
-        #     self.glob_pc = self.rs[operation][i].result
-        #     self.cdb = False
+        if station.fault != None and self.rob == None:
+            raise station.fault
+        entry = self.rob_lookup.get(station.seq) if self.rob != None else None
+        if entry != None:
+            entry.fault = station.fault
+        handler.write(self, station)
+        if handler.stalls_issue == True: # the pc is known now, issue can go on
+            self.jal_issued = False
+        if entry != None and station.busy == False:
+            entry.done = True
 
-        else: # LOAD, ADDI, ADD, NEG, NAND, SLL
-            # For load and arithmetic operations
-            r_name = self.rs[operation][i].name
+    def broadcast(self, station):
+        # Put the station's result on the CDB: its destination register and the stations waiting on its tag
+        tag = station.tag
 
-            for reg, value in self.register_stat.items(): # gets qi
-                if (self.register_stat[reg] == r_name):
-                    self.register_stat[reg] = None
-                    print("Destination Register: ", reg)
-                    if (reg != "R0"):
-                        self.RegFile[reg] = self.rs[operation][i].result
+        reg = self.tag_dest[tag] # gets qi
+        self.tag_dest[tag] = None
+        if reg != None and self.rename_map != None:
+            self.write_phys(station, reg)
+        elif (reg != None and self.register_stat[reg] == tag):
+            self.register_stat[reg] = None
+            if self.trace_level >= TRACE_EVENTS:
+                self.tracer.log("Destination Register: ", reg)
+            if self.rob != None: # architectural at commit, until then later readers take it from the ROB
+                entry = self.rob_lookup[station.seq]
+                entry.value = station.result
+                self.spec_regs[reg] = entry
+            elif (reg != "R0"):
+                self.RegFile[reg] = station.result
 
-            for inst in self.inst_types:
-                for sub_entry in range(self.num_rs[inst]):
-                    if (self.rs[inst][sub_entry].qj == r_name):
-                        self.rs[inst][sub_entry].vj = self.rs[operation][i].result
-                        self.rs[inst][sub_entry].qj = None
-
-                    if (self.rs[inst][sub_entry].qk == r_name):
-                        self.rs[inst][sub_entry].vk = self.rs[operation][i].result
-                        self.rs[inst][sub_entry].qk = None
-            if (operation == "JAL"):
-                self.glob_pc = self.rs[operation][i].result
-                
-            self.empty_entry(self.rs[operation][i])
-            self.cdb = False
-            print("I, ", operation, ", am writing in clock cycle: ", self.clock_cycles)
+        # Only the stations that captured this tag at issue are waiting on the broadcast
+        waiting = self.consumers[tag]
+        self.consumers[tag] = []
+        for [consumer, field] in waiting:
+            if (field == "j" and consumer.qj == tag):
+                consumer.vj = station.result
+                consumer.qj = None
+                self.mark_ready(consumer.op, consumer.index)
+
+            if (field == "k" and consumer.qk == tag):
+                consumer.vk = station.result
+                consumer.qk = None
+                self.mark_ready(consumer.op, consumer.index)
 
     def empty_entry(self, station):
+        self.station_cycles[station.opcode] += self.clock_cycles - station.issue_cycle + 1
         station.busy = False
         station.vj = None
         station.vk = None
@@ -553,118 +1515,573 @@ class Tomasulo:
         station.A = None
         station.result = None
         station.executed = False
-        r_name = station.name 
-        for reg, value in self.register_stat.items(): # gets qi
-                if (self.register_stat[reg] == r_name):
-                    self.register_stat[reg] = None
+        station.done_cycle = None
+        station.fault = None
+        station.phys = None
+        station.prev_phys = None
+        self.progress = True
+        self.ready[station.opcode].discard(station.index)
+        self.consumers[station.tag] = [] # only left over when a flushed station had consumers
+        reg = self.tag_dest[station.tag] # gets qi
+        self.tag_dest[station.tag] = None
+        if (reg != None and self.register_stat[reg] == station.tag):
+            self.register_stat[reg] = None
  
-    def flush_all(self, operation, i):
-        if (self.rs[operation][i].pc > self.rs[operation][i].result): # up
-            for [op, index] in self.branch_queue:
-                # print("Operation: ", op, " & index: ", index)
-                self.empty_entry(self.rs[op][index])
-        elif (self.rs[operation][i].pc < self.rs[operation][i].result): #down
-            print("I would like to branch down the program")
-            # compare target address with pcs in queue --> flush pcs < target address
-            for [op, index] in self.branch_queue:
-                print("Op: ", op, " index: ", index, " PC: ", self.rs[op][index].pc)
-                if (self.rs[op][index].pc < self.rs[operation][i].result):
-                    self.empty_entry(self.rs[op][index])
+    def resolve_branch(self, branch):
+        # Train the predictor; on a misprediction squash everything younger and fetch the right path
+        taken = branch.result != None
+        actual = branch.result if taken == True else branch.pc + 1
+        if self.trace_driven == True: # the next trace record is the path it took
+            actual = branch.pc + 1
+        if self.rob != None: # checked when it commits
+            self.rob_lookup[branch.seq].next_pc = actual
+            self.rob_lookup[branch.seq].value = branch.result
+            return
+        predicted = branch.prediction if branch.prediction != None else branch.pc + 1
+        self.predictor.update(branch.pc, taken, branch.result)
+        self.branch_count += 1
+        self.unresolved.popleft()
+        if self.rename_map != None and actual == predicted:
+            del self.rename_snapshots[branch.seq]
+        if (actual != predicted):
+            self.mispredictions += 1
+            if self.trace_level >= TRACE_EVENTS:
+                self.tracer.log("Branch at PC ", branch.pc, " mispredicted, fetching from ", actual)
+            self.squash(branch.seq)
+            self.redirect(actual)
 
-        
-        # #reset all reservation stations by calling empty_entry
-        # for res_st in self.rs[operation]:
-        #     self.empty_entry(res_st)
-        
-        # #reset register status
-        # for reg in self.register_stat:
-        #     self.register_stat[reg] = None
+    def squash(self, seq):
+        # Empty every station issued after seq; none of them has written anything yet
+        for station in self.stations:
+            if station.busy == True and station.seq > seq:
+                if self.trace_level >= TRACE_EVENTS:
+                    self.tracer.log("Flushing ", station.name, " PC: ", station.pc)
+                if self.handlers[station.opcode].stalls_issue == True:
+                    self.jal_issued = False
+                if station.phys != None and self.rob == None:
+                    self.free_phys(station.phys)
+                self.empty_entry(station)
+                if self.rob == None:
+                    self.flushed_count += 1
+        self.unresolved = collections.deque(branch for branch in self.unresolved if branch < seq)
+        self.load_queue.squash(seq)
+        self.store_queue.squash(seq)
+        if self.rename_map != None:
+            self.recover_rename(seq)
+        if self.rob != None:
+            while len(self.rob) > 0 and self.rob[-1].seq > seq:
+                del self.rob_lookup[self.rob.pop().seq]
+                self.flushed_count += 1
+            self.rebuild_spec_regs()
+
+    def rebuild_spec_regs(self):
+        # WAW stalls keep the writes to a register in program order, so the youngest written entry wins
+        self.spec_regs = {}
+        for entry in self.rob:
+            if entry.done == True and entry.dest != None:
+                self.spec_regs[entry.dest] = entry
+
+    def jump(self, station, pc):
+        # JAL / RET write: redirect now, or with a ROB record the target and check it at commit
+        if self.trace_driven == True: # already followed by its target's record
+            pc = station.pc + 1
+            if self.rob == None:
+                return
+        if self.rob != None:
+            self.rob_lookup[station.seq].next_pc = pc
+        else:
+            self.redirect(pc)
+
+    def address_queue(self, handler):
+        return self.load_queue if handler.memory == "load" else self.store_queue
+
+    def resolve_address(self, station, address):
+        # LOAD / STORE effective address, from now on known to the load-store queue
+        station.A = address
+        self.address_queue(self.handlers[station.opcode]).resolve(station.seq, address)
+        self.progress = True # may let a waiting LOAD or STORE go
+
+    def store(self, station):
+        # STORE write: to memory now, or with a ROB buffered in its entry until it commits
+        if self.rob != None:
+            entry = self.rob_lookup[station.seq]
+            entry.address = station.A
+            entry.value = station.vk
+        else:
+            self.memory[station.A] = station.vk
+            self.store_queue.remove(station.seq)
+
+    def store_data(self, seq):
+        # Value of a STORE in the queue, None while it still waits for it
+        [address, tag] = self.store_queue.entries[seq]
+        station = self.stations[tag]
+        if station.busy == True and station.seq == seq:
+            return station.vk if station.qk == None else None
+        return self.rob_lookup[seq].value # written, waiting in the ROB to commit
+
+    def load_blocked(self, station):
+        # A LOAD reads once every older STORE has an address and the latest one to its address has its value
+        if self.store_queue.unknown_before(station.seq):
+            return True
+        store = self.store_queue.latest_before(station.seq, station.A)
+        return store != None and self.store_data(store) == None
+
+    def store_blocked(self, station):
+        # Without a ROB a STORE goes straight to memory, so older LOADs and STOREs that may use its address go first
+        if self.rob != None:
+            return False
+        if self.store_queue.unknown_before(station.seq) or self.load_queue.unknown_before(station.seq):
+            return True
+        return (self.store_queue.latest_before(station.seq, station.A) != None
+                or self.load_queue.latest_before(station.seq, station.A) != None)
+
+    def load(self, station):
+        # LOAD read: forwarded from the latest older STORE to the same address, else from memory
+        self.load_queue.remove(station.seq)
+        if station.fault != None: # bad address, raised at commit
+            return None
+        store = self.store_queue.latest_before(station.seq, station.A)
+        if store != None:
+            return self.store_data(store)
+        return self.memory[station.A]
+
+    def commit_all(self):
+        # Retire up to commit_width finished instructions from the ROB head, in program order
+        committed = 0
+        while committed < self.commit_width and len(self.rob) > 0 and self.rob[0].done == True:
+            entry = self.rob.popleft()
+            del self.rob_lookup[entry.seq]
+            committed += 1
+            self.progress = True
+            if entry.fault != None:
+                raise entry.fault
+            if self.trace_level >= TRACE_EVENTS:
+                self.tracer.log("Committing ", entry.op, " PC: ", entry.pc, " in clock cycle: ", self.clock_cycles)
+            if entry.dest != None:
+                self.RegFile[entry.dest] = entry.value
+                if self.rename_map != None:
+                    self.commit_map[entry.dest] = entry.phys
+                    self.free_phys(entry.prev_phys)
+                elif self.spec_regs.get(entry.dest) is entry:
+                    del self.spec_regs[entry.dest]
+            if entry.address != None:
+                self.memory[entry.address] = entry.value
+                self.store_queue.remove(entry.seq)
+            handler = self.handlers[OPCODES[entry.op]]
+            if handler.call == True:
+                self.commit_ras.append(entry.pc + 1)
+            elif handler.returns == True and len(self.commit_ras) > 0:
+                self.commit_ras.pop()
+            branch = handler.branch
+            if branch == True:
+                self.predictor.update(entry.pc, entry.value != None, entry.value)
+                self.branch_count += 1
+            if entry.next_pc != None and entry.next_pc != entry.predicted:
+                # everything behind it came from the wrong path: flush the ROB and fetch from the right pc
+                if branch == True:
+                    self.mispredictions += 1
+                if self.trace_level >= TRACE_EVENTS:
+                    self.tracer.log(entry.op, " at PC ", entry.pc, " mispredicted, flushing the ROB and fetching from ", entry.next_pc)
+                self.squash(entry.seq)
+                self.ras = list(self.commit_ras)
+                self.redirect(entry.next_pc)
+                return
+
+    def print_rob(self):
+        self.tracer.log("\nReorder Buffer:\n")
+        for entry in self.rob:
+            self.tracer.log(f"{entry.seq}: op = {entry.op}, pc = {entry.pc}, dest = {entry.dest}, value = {entry.value}, done = {entry.done}")
+
+    def tag_name(self, tag):
+        # Station name behind a tag, for printing
+        return None if tag == None else self.stations[tag].name
 
-        # # Reset program counter (PC) to target address
-        # self.pc = self.rs[operation][i].result            
-            
     def print_reservation_stations(self):
-        print("Reservation Stations:")
+        self.tracer.log("Reservation Stations:")
         for inst in self.inst_types:
             # print("\n", inst, " Instructions:")
-            for i in range(self.num_rs[inst]):
+            for i in range(len(self.rs[inst])):
                 rs = self.rs[inst][i]
                 if rs.busy == True:
-                    print(
-                        f"{rs.name}: op = {rs.op}, busy = {rs.busy}, vj = {rs.vj}, vk = {rs.vk}, qj = {rs.qj}, qk = {rs.qk}, result = {rs.result}")
+                    self.tracer.log(
+                        f"{rs.name}: op = {rs.op}, busy = {rs.busy}, vj = {rs.vj}, vk = {rs.vk}, qj = {self.tag_name(rs.qj)}, qk = {self.tag_name(rs.qk)}, result = {rs.result}")
 
     def print_register_status(self):
-        print("\nRegister Status:\n")
+        self.tracer.log("\nRegister Status:\n")
+        if self.rename_map != None:
+            for reg, phys in self.rename_map.items():
+                self.tracer.log(f"{reg}: P{phys} {self.tag_name(self.phys_tag[phys])}")
+            return
         for reg, value in self.register_stat.items():
-            print(f"{reg}: {value}")
+            self.tracer.log(f"{reg}: {self.tag_name(value)}")
 
     def register_file(self):
-        print("\nRegister File:\n")
+        self.tracer.log("\nRegister File:\n")
         for reg, value in self.RegFile.items():
-            print(f"{reg}: {value}")
+            self.tracer.log(f"{reg}: {value}")
 
     def memory_state(self):
-        print("\nMemory State:\n")
+        self.tracer.log("\nMemory State:\n")
         # print(self.memory[address])
-        for i in range(len(self.memory)):
-            print(f"{i}: {self.memory[i]}")
+        for address, value in self.memory.words(): # zero words are skipped
+            self.tracer.log(f"{address}: {value}")
 
-    def run(self):
+    def checkpoint(self):
+        # Complete simulator state as a compressed pickle of plain values
+        return zlib.compress(pickle.dumps(self.capture(), pickle.HIGHEST_PROTOCOL))
+
+    def capture(self):
+        return {
+            "version": CHECKPOINT_VERSION,
+            "instructions": self.instructions,
+            "num_rs": dict(self.num_rs),
+            "instruction_cycles": dict(self.instuction_cycles),
+            "clock_cycles": self.clock_cycles,
+            "glob_pc": self.glob_pc,
+            "fetch_pc": self.fetch_pc,
+            "iq": [[pc, prediction] for [pc, instruction, prediction] in self.iq],
+            "cdb": self.cdb,
+            "num_cdb": self.num_cdb,
+            "write_queue": [list(entry) for entry in self.write_queue],
+            "issue_seq": self.issue_seq,
+            "predictor": [type(self.predictor).__name__, vars(self.predictor)],
+            "issue_width": self.issue_width,
+            "fetch_width": self.fetch_width,
+            "iq_size": self.iq_size,
+            "max_branches": self.max_branches,
+            "unresolved": list(self.unresolved),
+            "rob_size": self.rob_size,
+            "trace_driven": self.trace_driven,
+            "commit_width": self.commit_width,
+            "rob": None if self.rob == None else [[getattr(entry, field) for field in RobEntry.__slots__] for entry in self.rob],
+            "ras": list(self.ras),
+            "load_queue": vars(self.load_queue),
+            "num_phys_regs": self.num_phys_regs,
+            "rename": None if self.rename_map == None else [self.rename_map, self.commit_map, self.phys_regs, self.phys_tag,
+                                                            list(self.free_list), self.rename_snapshots],
+            "store_queue": vars(self.store_queue),
+            "commit_ras": list(self.commit_ras),
+            "branch_count": self.branch_count,
+            "mispredictions": self.mispredictions,
+            "jal_issued": self.jal_issued,
+            "RegFile": dict(self.RegFile),
+            "register_stat": dict(self.register_stat),
+            "memory": [self.memory.capacity, self.memory.word_size, bytes(self.memory.data)],
+            "stations": [[getattr(station, field) for field in STATION_STATE] for station in self.stations],
+            "consumers": [[[consumer.tag, field] for [consumer, field] in waiting] for waiting in self.consumers],
+            "tag_dest": list(self.tag_dest),
+            "ready": [sorted(ready) for ready in self.ready],
+            "completions": [list(entry) for entry in self.completions],
+            "issued_count": self.issued_count,
+            "stall_cycles": self.stall_cycles,
+            "fast_forwarded": self.fast_forwarded,
+            "flushed_count": self.flushed_count,
+            "stall_counts": list(self.stall_counts),
+            "stall_reason": self.stall_reason,
+            "cdb_conflicts": self.cdb_conflicts,
+            "fu_conflicts": self.fu_conflicts,
+            "num_fus": self.num_fus,
+            "initiation_interval": self.initiation_interval if self.num_fus != None else None,
+            "fu_free": self.fu_free,
+            "station_cycles": list(self.station_cycles),
+            "unit_cycles": list(self.unit_cycles),
+            "issue_until": self.issue_until,
+            "finished": self.finished
+        }
+
+    def restore(self, data):
+        state = pickle.loads(zlib.decompress(data))
+        if state["version"] != CHECKPOINT_VERSION:
+            raise ValueError(f"Checkpoint version {state['version']} is not supported")
+        if [station.name for station in self.stations] != [station.name for station in Tomasulo.layout(state["num_rs"])]:
+            raise ValueError("Checkpoint was taken with a different reservation station configuration")
+        self.clock_cycles = state["clock_cycles"]
+        self.glob_pc = state["glob_pc"]
+        self.fetch_pc = state["fetch_pc"]
+        self.iq = collections.deque([pc, self.program.get(pc), prediction] for [pc, prediction] in state["iq"])
+        self.cdb = state["cdb"]
+        self.num_cdb = state["num_cdb"]
+        self.write_queue = state["write_queue"] # saved in heap order
+        self.issue_seq = state["issue_seq"]
+        [name, values] = state["predictor"]
+        if type(self.predictor).__name__ != name:
+            raise ValueError(f"Checkpoint was taken with a {name}, not a {type(self.predictor).__name__}")
+        self.predictor.__dict__.update(values)
+        self.issue_width = state["issue_width"]
+        self.fetch_width = state["fetch_width"]
+        self.iq_size = state["iq_size"]
+        self.max_branches = state["max_branches"]
+        self.unresolved = collections.deque(state["unresolved"])
+        self.rob_size = state["rob_size"]
+        self.trace_driven = state["trace_driven"]
+        self.commit_width = state["commit_width"]
+        self.rob = None
+        self.rob_lookup = {}
+        if state["rob"] != None:
+            self.rob = collections.deque()
+            for values in state["rob"]:
+                entry = RobEntry(None, None, None, None, None)
+                for field, value in zip(RobEntry.__slots__, values):
+                    setattr(entry, field, value)
+                self.rob.append(entry)
+                self.rob_lookup[entry.seq] = entry
+            self.rebuild_spec_regs()
+        self.ras = state["ras"]
+        self.load_queue = AddressQueue()
+        self.load_queue.__dict__.update(state["load_queue"])
+        self.store_queue = AddressQueue()
+        self.store_queue.__dict__.update(state["store_queue"])
+        self.num_phys_regs = state["num_phys_regs"]
+        self.rename_map = None
+        if state["rename"] != None:
+            [self.rename_map, self.commit_map, self.phys_regs, self.phys_tag, free_list, self.rename_snapshots] = state["rename"]
+            self.free_list = collections.deque(free_list)
+        self.commit_ras = state["commit_ras"]
+        self.branch_count = state["branch_count"]
+        self.mispredictions = state["mispredictions"]
+        self.jal_issued = state["jal_issued"]
+        self.RegFile = state["RegFile"]
+        self.register_stat = state["register_stat"]
+        [capacity, word_size, data] = state["memory"]
+        self.memory = Memory(capacity, word_size)
+        self.memory.data[:] = data
+        for station, values in zip(self.stations, state["stations"]):
+            for field, value in zip(STATION_STATE, values):
+                setattr(station, field, value)
+        self.consumers = [[[self.stations[tag], field] for [tag, field] in waiting] for waiting in state["consumers"]]
+        self.tag_dest = state["tag_dest"]
+        self.ready = [set(ready) for ready in state["ready"]]
+        self.completions = state["completions"] # saved in heap order
+        self.issued_count = state["issued_count"]
+        self.stall_cycles = state["stall_cycles"]
+        self.fast_forwarded = state["fast_forwarded"]
+        self.flushed_count = state["flushed_count"]
+        self.stall_counts = state["stall_counts"]
+        self.stall_reason = state["stall_reason"]
+        self.cdb_conflicts = state["cdb_conflicts"]
+        self.fu_conflicts = state["fu_conflicts"]
+        self.num_fus = state["num_fus"]
+        self.fu_free = state["fu_free"]
+        if self.num_fus != None:
+            self.initiation_interval = state["initiation_interval"]
+        self.station_cycles = state["station_cycles"]
+        self.unit_cycles = state["unit_cycles"]
+        self.issue_until = state["issue_until"]
+        self.finished = state["finished"]
+        self.active = []
+        self.progress = False
+        self.unit_wait = None
+        self.unit_waiting = 0
+
+    @staticmethod
+    def layout(num_rs):
+        # Stations a configuration would build, in tag order
+        return [ReservationStation(i, f"{inst}{i+1}", inst) for inst in INST_TYPES for i in range(num_rs.get(inst, 0))]
+
+    @classmethod
+    def from_checkpoint(cls, data, **kwargs):
+        # New simulator with the checkpoint's program and configuration, resumed from it. A streamed
+        # program is not in the checkpoint: instructions= gives a fresh stream, read up to the checkpoint's pc
+        state = pickle.loads(zlib.decompress(data))
+        for key, predictor in PREDICTORS.items():
+            if predictor.__name__ == state["predictor"][0]:
+                kwargs.setdefault("predictor", key)
+        kwargs.setdefault("rob_size", state["rob_size"])
+        kwargs.setdefault("trace_driven", state["trace_driven"])
+        kwargs.setdefault("num_phys_regs", state["num_phys_regs"])
+        kwargs.setdefault("num_fus", state["num_fus"])
+        kwargs.setdefault("initiation_interval", state["initiation_interval"])
+        instructions = kwargs.pop("instructions", state["instructions"])
+        if instructions == None:
+            raise ValueError("Checkpoint of a streamed program, pass instructions= to read the stream again")
+        tomasulo = cls(instructions, num_rs=state["num_rs"], instruction_cycles=state["instruction_cycles"], **kwargs)
+        tomasulo.restore(data)
+        return tomasulo
+
+    def save_checkpoint(self, path):
+        with open(path, "wb") as f:
+            f.write(self.checkpoint())
+
+    def load_checkpoint(self, path):
+        with open(path, "rb") as f:
+            self.restore(f.read())
+
+    def fetching(self):
+        # The front end still has instructions to issue in this run
+        if self.program.has(self.glob_pc) == False: # the end of the program, or of the stream
+            return False
+        return self.issue_until == None or self.issued_count < self.issue_until
+
+    def fast_forward(self, max_instructions=None, until_pc=None):
+        # Run from glob_pc on the functional model (no cycles pass), then carry on in detail from
+        # where it stopped. Only the architectural state is handed over, so nothing may be in flight.
+        for station in self.stations:
+            if station.busy == True or (self.rob != None and len(self.rob) > 0):
+                raise RuntimeError("fast_forward needs an empty pipeline, run() until it drains first")
+        functional = FunctionalSim(self.program, self.RegFile, self.memory, self.glob_pc)
+        count = functional.run(max_instructions, until_pc)
+        if self.rename_map != None:
+            self.reset_rename()
+        self.redirect(functional.pc)
+        self.fast_forwarded += count
+        if self.fetching() == False and self.issue_until == None:
+            self.finished = True
+        return count
+
+    def run_sampled(self, fast_forward, warmup, measure):
+        # Sampled simulation: repeat [fast-forward, detailed warm-up, detailed measurement] windows
+        # (in instructions) until the program ends. Only the measured windows count towards the IPC.
+        samples = []
+        while self.finished == False:
+            self.fast_forward(fast_forward)
+            if self.finished == True:
+                break
+            if warmup > 0:
+                self.run(issue_limit=warmup)
+                if self.finished == True:
+                    break
+            start_pc = self.glob_pc
+            start_cycle = self.clock_cycles
+            start_retired = self.issued_count - self.flushed_count
+            self.run(issue_limit=measure)
+            samples.append({"pc": start_pc, "instructions": self.issued_count - self.flushed_count - start_retired,
+                            "cycles": self.clock_cycles - start_cycle})
+        instructions = sum(sample["instructions"] for sample in samples)
+        cycles = sum(sample["cycles"] for sample in samples)
+        return {"samples": samples, "instructions": instructions, "cycles": cycles,
+                "ipc": instructions / cycles if cycles > 0 else None}
+
+    def result(self):
+        # Metrics so far as a RunResult; run() returns this too
+        return RunResult(self)
+
+    def add_checkpoint(self):
+        i = bisect.bisect_left(self.checkpoint_cycles, self.clock_cycles)
+        if i < len(self.checkpoint_cycles) and self.checkpoint_cycles[i] == self.clock_cycles:
+            return
+        self.checkpoint_cycles.insert(i, self.clock_cycles)
+        self.checkpoints.insert(i, self.checkpoint())
+
+    def seek(self, cycle):
+        # Jump to the end of a cycle: restore the latest periodic checkpoint at or before it and simulate the rest
+        i = bisect.bisect_right(self.checkpoint_cycles, cycle) - 1
+        if i < 0:
+            raise ValueError(f"No checkpoint at or before cycle {cycle}")
+        self.restore(self.checkpoints[i])
+        if self.finished == False:
+            self.run(stop_at_cycle=cycle)
+
+    def run(self, checkpoint_every=None, stop_at_cycle=None, issue_limit=None):
+        # checkpoint_every: keep a checkpoint in self.checkpoints every N cycles (seek() uses them)
+        # stop_at_cycle: pause after that cycle; calling run() again resumes
+        # issue_limit: issue at most N more instructions, then return once they have all written
+        #              (the state is then architectural, e.g. for fast_forward())
+        if self.finished == True:
+            return self.result()
+        if issue_limit != None:
+            self.issue_until = self.issued_count + issue_limit
+        cache_key = None
+        if self.result_cache != None and self.profiler == None and self.instructions != None and self.clock_cycles == 0 and checkpoint_every == None and stop_at_cycle == None and issue_limit == None:
+            cache_key = self.result_cache.key(self)
+            data = self.result_cache.get(cache_key)
+            if data != None: # simulated before: jump straight to the end
+                self.restore(data)
+                if self.trace_level >= TRACE_SUMMARY:
+                    self.print_summary()
+                self.tracer.flush()
+                return self.result()
         # pc = 0
         # Each iteration represents a clock cycle
-        total_instructions = len(self.instructions)
+        total_rs = len(self.stations)
         # total_instructions -= 1
         while True:
-            print("*******************************************************************************************************")
-            print("WE ARE IN CLOCK CYCLE: ", self.clock_cycles + 1)
-            ctr = 0
-            self.cdb = True
+            if checkpoint_every != None and self.clock_cycles % checkpoint_every == 0:
+                self.add_checkpoint()
+            if stop_at_cycle != None and self.clock_cycles >= stop_at_cycle:
+                self.tracer.flush()
+                return self.result()
+            if self.trace_level >= TRACE_EVENTS:
+                self.tracer.log("*******************************************************************************************************")
+                self.tracer.log("WE ARE IN CLOCK CYCLE: ", self.clock_cycles + 1)
+            self.cdb = self.num_cdb
+            self.progress = False
+            self.active = []
+            self.unit_wait = None
+            self.unit_waiting = 0
             self.clock_cycles += 1
-            instruction = self.fetch(self.glob_pc)
-            print("Before - PC: ", self.glob_pc)
-            if (self.glob_pc < total_instructions): #check if last instruction
-                print("Instruction: ", instruction)
-                if (self.issue(instruction, self.glob_pc)): # issue or not issue --> stall
-                    self.glob_pc += 1
+            if self.trace_level >= TRACE_EVENTS:
+                self.tracer.log("Before - PC: ", self.glob_pc)
+            self.fetch_all()
+            self.issue_all()
             self.execute_all()
+            if self.rob != None:
+                self.commit_all()
             self.write_all()
-            self.print_reservation_stations()
-            self.print_register_status()
-            self.register_file()   
-            print("Glob_PC: ", self.glob_pc, "Total Instruciton: ", total_instructions - 1)
-            if (self.glob_pc == total_instructions):
-                for inst in self.inst_types: #check if rs are empty
-                    for i in range(self.num_rs[inst]):
-                        if (self.rs[inst][i].busy == False):
-                            ctr += 1
-            # and pc == len(self.instructions)):
-
-            print("Counter: ", ctr, " Sum: ", sum(self.num_rs.values()))
-            if (ctr == sum(self.num_rs.values())): #check if pc is last instruction
-                print("We will break here!")
+            if self.trace_level >= TRACE_FULL:
+                self.print_reservation_stations()
+                self.print_register_status()
+                self.register_file()   
+                if self.rob != None:
+                    self.print_rob()
+            if self.trace_level >= TRACE_EVENTS:
+                self.tracer.log("Glob_PC: ", self.glob_pc, "Total Instruciton: ", None if self.program.end == None else self.program.end - 1)
+            ctr = self.free_stations()
+
+            if self.trace_level >= TRACE_EVENTS:
+                self.tracer.log("Counter: ", ctr, " Sum: ", total_rs)
+            if (ctr == total_rs): #check if pc is last instruction
+                if self.trace_level >= TRACE_EVENTS:
+                    self.tracer.log("We will break here!")
+                if self.issue_until != None and self.program.has(self.glob_pc): # end of the issue_limit window
+                    self.issue_until = None
+                    self.tracer.flush()
+                    return self.result()
+                self.issue_until = None
+                self.finished = True
                 break
             # if (self.clock_cycles == 6):
             #     break   
+            if (self.event_driven == True):
+                limit = stop_at_cycle
+                if checkpoint_every != None:
+                    boundary = (self.clock_cycles // checkpoint_every + 1) * checkpoint_every
+                    limit = boundary if limit == None else min(limit, boundary)
+                self.skip_idle_cycles(limit)
+
+        if checkpoint_every != None:
+            self.add_checkpoint() # final state
+        if cache_key != None:
+            self.result_cache.put(cache_key, self.checkpoint())
+        if self.trace_level >= TRACE_SUMMARY:
+            self.print_summary()
+        if self.profiler != None: # printed whatever the trace level, that is what profile= asked for
+            for line in self.profiler.report():
+                self.tracer.log(line)
+        self.tracer.flush()
+        return self.result()
+
+    def free_stations(self):
+        # End of cycle: once nothing is left to issue or commit, the number of free stations (the run is
+        # over when every station is free); 0 while the front end still has work
+        ctr = 0
+        if (self.fetching() == False and (self.rob == None or len(self.rob) == 0)):
+            for inst in self.inst_types: #check if rs are empty
+                for i in range(len(self.rs[inst])):
+                    if (self.rs[inst][i].busy == False):
+                        ctr += 1
+        return ctr
 
-        print("Execution completed.")
+    def print_summary(self):
+        self.tracer.log("Execution completed.")
         self.print_reservation_stations()
         self.print_register_status()
         self.register_file()
         # self.memory_state()
 
-        print("Total Clock Cycles: ", self.clock_cycles)
-
-class MainMenu:
-    def __init__(self, tomasulo):
-        self.tomasulo = tomasulo
-
-        def displayMain():
-            print("Welcome to the Tomasulo Simulator!")
-            print("Please select an option:")
-            print("1. Run")
-            print("2. Exit")
-            
-            return
+        self.tracer.log("Total Clock Cycles: ", self.clock_cycles)
+        self.tracer.log("IPC: ", round(self.result().ipc, 3))
+        if self.branch_count > 0:
+            self.tracer.log("Branch prediction accuracy: ", round(self.result().accuracy, 3))
 
 # Need to read from a file and parse into a similar array
 # instructions = [
@@ -711,9 +2128,121 @@ execution_cycles = {
     "SLL": 1
 }
 
-tomasulo = Tomasulo(instructions, num_rs=var_rs,
-                    instruction_cycles=execution_cycles)
-tomasulo.run()
+def read_program(path, stream=False):
+    # Instruction list of a JSON file or an assembly file; stream=True reads assembly lazily instead
+    if path.endswith(".json"):
+        with open(path) as f:
+            return json.load(f)
+    if stream == True:
+        return stream_program(path)
+    return load_program(path)
+
+
+def load_config(path):
+    # JSON object with num_rs / instruction_cycles by type (types left out keep var_rs / execution_cycles)
+    # and any other Tomasulo argument, e.g. {"num_rs": {"ADD": 4}, "instruction_cycles": {"LOAD": 2}, "rob_size": 16}.
+    # trace_level may be a TRACE_NAMES name and result_cache a directory
+    with open(path) as f:
+        config = json.load(f)
+    if isinstance(config.get("trace_level"), str):
+        config["trace_level"] = TRACE_NAMES[config["trace_level"]]
+    if isinstance(config.get("result_cache"), str):
+        config["result_cache"] = ResultCache(config["result_cache"])
+    config["num_rs"] = {**var_rs, **config.get("num_rs", {})}
+    config["instruction_cycles"] = {**execution_cycles, **config.get("instruction_cycles", {})}
+    return config
+
+
+def parse_counts(specs):
+    # ["ADD=4", "LOAD=2"] -> {"ADD": 4, "LOAD": 2}
+    counts = {}
+    for spec in specs or []:
+        [inst, value] = spec.split("=")
+        if inst.upper() not in INST_TYPES:
+            raise ValueError(f"Unknown instruction type {inst}")
+        counts[inst.upper()] = int(value)
+    return counts
+
+
+def main(argv=None):
+    # python -m Tom prog1.s prog2.json ... --config machine.json: every program on every configuration in
+    # one process. Without programs it runs the example program above with full tracing.
+    parser = argparse.ArgumentParser(prog="python -m Tom", description="Run programs on the Tomasulo simulator")
+    parser.add_argument("programs", nargs="*", help="assembly or JSON instruction list files (default: the example program)")
+    parser.add_argument("--config", action="append", help="JSON machine configuration, repeat to run every program on each")
+    parser.add_argument("--rs", action="append", help="TYPE=N reservation stations, over the configuration's")
+    parser.add_argument("--cycles", action="append", help="TYPE=N execution cycles, over the configuration's")
+    parser.add_argument("--trace", choices=list(TRACE_NAMES), help="trace level (default: off, full for the example program)")
+    parser.add_argument("--event-driven", action="store_true", help="use the event-driven clock")
+    parser.add_argument("--stream", action="store_true",
+                        help="read assembly files lazily, for long traces; branch and jump targets must be offsets, labels are rejected")
+    parser.add_argument("--trace-driven", action="store_true",
+                        help="the programs are dynamic traces: BNE / JAL / RET are followed by the record that ran next")
+    parser.add_argument("--cache", nargs="?", const=DEFAULT_RESULT_CACHE_DIR, help="reuse results of runs simulated before")
+    parser.add_argument("--out", help="also write one result row per run to a .csv or .jsonl file")
+    parser.add_argument("--profile", action="store_true", help="print the host time of every pipeline stage and op after each run")
+    parser.add_argument("--cprofile", help="FIRST:LAST cycles to also run under cProfile, e.g. 1000:2000 (implies --profile)")
+    args = parser.parse_args(argv)
+
+    configs = [[path, load_config(path)] for path in args.config or []]
+    if len(configs) == 0:
+        configs = [["default", {"num_rs": dict(var_rs), "instruction_cycles": dict(execution_cycles)}]]
+    for [name, config] in configs:
+        config["num_rs"].update(parse_counts(args.rs))
+        config["instruction_cycles"].update(parse_counts(args.cycles))
+    # Tomasulo arguments of every run: these defaults, then the configuration's, then the flags given
+    defaults = {"trace_level": TRACE_FULL if len(args.programs) == 0 else TRACE_OFF, "event_driven": False,
+                "trace_driven": False, "result_cache": None, "profile": None}
+    flags = {}
+    if args.trace != None:
+        flags["trace_level"] = TRACE_NAMES[args.trace]
+    if args.event_driven == True:
+        flags["event_driven"] = True
+    if args.trace_driven == True:
+        flags["trace_driven"] = True
+    if args.cache != None:
+        flags["result_cache"] = ResultCache(args.cache)
+    cycles = [int(cycle) for cycle in args.cprofile.split(":")] if args.cprofile != None else None
+    rows = []
+    failed = 0
+    print(f"{'program':<24} {'config':<16} {'cycles':>9} {'instrs':>8} {'ipc':>6} {'host s':>8}")
+    for path in args.programs or [None]:
+        for [name, config] in configs:
+            row = {"program": path or "example", "config": name}
+            start = time.perf_counter()
+            try:
+                program = instructions if path == None else read_program(path, args.stream)
+                kwargs = {**defaults, **config, **flags}
+                if args.profile == True or cycles != None: # a fresh profiler per run
+                    kwargs["profile"] = Profiler(cycles)
+                tomasulo = Tomasulo(program, **kwargs)
+                row.update(tomasulo.run().as_dict())
+                row["error"] = ""
+            except Exception as e: # report it and go on with the other runs
+                failed += 1
+                row["error"] = f"{type(e).__name__}: {e}"
+            row["host_seconds"] = time.perf_counter() - start
+            rows.append(row)
+            if row["error"] != "":
+                print(f"{row['program']:<24} {name:<16} {row['error']}")
+            else:
+                print(f"{row['program']:<24} {name:<16} {row['clock_cycles']:>9} {row['instructions']:>8} "
+                      f"{row['ipc']:>6.3f} {row['host_seconds']:>8.3f}")
+    if args.out != None:
+        with open(args.out, "w", newline="") as out:
+            if args.out.endswith(".jsonl"):
+                for row in rows:
+                    out.write(json.dumps(row) + "\n")
+            else:
+                columns = ["program", "config"] + RunResult.columns() + ["error", "host_seconds"]
+                writer = csv.DictWriter(out, fieldnames=columns)
+                writer.writeheader()
+                writer.writerows(rows)
+    return 1 if failed > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
 
 
 # find the sum of the values in num_rs
@@ -0,0 +1,236 @@
+# Assembler for the ten instructions supported by Tom.py
+#
+#   loop:  LOAD  R1, 4(R2)        # rd, imm(rs1)
+#          STORE R3, 0(R1)        # rs2, imm(rs1)   memory[rs1 + imm] = rs2
+#          BNE   R1, R2, loop     # rs1, rs2, label or offset
+#          JAL   func             # label or offset, links into R1
+#          RET
+#          ADD   R1, R2, R3       # also NAND and SLL
+#          ADDI  R1, R2, -3
+#          NEG   R1, R2
+#
+# Comments start with '#' or ';'. Branch and jump targets are pc relative the same way the
+# simulator computes them (target = pc + imm). Programs are pre-decoded into tuples of
+# (op, rd, rs1, rs2, imm) and kept in an on-disk cache keyed by the source's content hash.
+# stream_program() reads a file one line at a time instead, for traces too long to hold in memory.
+
+import hashlib
+import marshal
+import os
+import re
+import sys
+
+REGISTERS = ["R0", "R1", "R2", "R3", "R4", "R5", "R6", "R7"]
+
+# Operand layout of every op, and the signed bit width of its immediate
+FORMATS = {
+    "LOAD": ["rd", "mem"],
+    "STORE": ["rs2", "mem"],
+    "BNE": ["rs1", "rs2", "target"],
+    "JAL": ["target"],
+    "RET": [],
+    "ADD": ["rd", "rs1", "rs2"],
+    "ADDI": ["rd", "rs1", "imm"],
+    "NEG": ["rd", "rs1"],
+    "NAND": ["rd", "rs1", "rs2"],
+    "SLL": ["rd", "rs1", "rs2"]
+}
+IMM_BITS = {"LOAD": 5, "STORE": 5, "BNE": 5, "ADDI": 5, "JAL": 7}
+
+# Bump when the decoded format changes so stale cache entries are not reused
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = os.environ.get("TOMASULO_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "tomasulo"))
+
+LABEL = re.compile(r"^([A-Za-z_][A-Za-z0-9_]*):")
+MEM_OPERAND = re.compile(r"^(.+)\((\w+)\)$")
+
+
+class AssemblyError(ValueError):
+    def __init__(self, line_no, message):
+        super().__init__(f"line {line_no}: {message}")
+        self.line_no = line_no
+
+
+def strip_comment(line):
+    for marker in ("#", ";"):
+        if marker in line:
+            line = line[:line.index(marker)]
+    return line.strip()
+
+
+def split_lines(text):
+    # First pass: collect labels and the (line number, op, operands) of every instruction
+    labels = {}
+    lines = []
+    for line_no, line in enumerate(text.splitlines(), 1):
+        line = strip_comment(line)
+        match = LABEL.match(line)
+        while match:
+            label = match.group(1)
+            if label.upper() in REGISTERS or label.upper() in FORMATS:
+                raise AssemblyError(line_no, f"label {label} is a reserved name")
+            if label in labels:
+                raise AssemblyError(line_no, f"label {label} is already defined")
+            labels[label] = len(lines)
+            line = line[match.end():].strip()
+            match = LABEL.match(line)
+        if line == "":
+            continue
+        parts = line.split(None, 1)
+        op = parts[0].upper()
+        operands = [operand.strip() for operand in parts[1].split(",")] if len(parts) > 1 else []
+        lines.append([line_no, op, operands])
+    return labels, lines
+
+
+def parse_register(line_no, text):
+    reg = text.upper()
+    if reg not in REGISTERS:
+        raise AssemblyError(line_no, f"invalid register {text}, expected R0-R7")
+    return reg
+
+
+def parse_imm(line_no, op, text):
+    try:
+        value = int(text, 0)
+    except ValueError:
+        raise AssemblyError(line_no, f"invalid immediate {text}")
+    check_range(line_no, op, value)
+    return value
+
+
+def check_range(line_no, op, value):
+    bits = IMM_BITS[op]
+    low, high = -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+    if value < low or value > high:
+        raise AssemblyError(line_no, f"{op} immediate {value} out of range [{low}, {high}]")
+
+
+def parse_instruction(line_no, op, operands, labels, pc):
+    if op not in FORMATS:
+        raise AssemblyError(line_no, f"unknown instruction {op}")
+    layout = FORMATS[op]
+    if len(operands) != len(layout):
+        raise AssemblyError(line_no, f"{op} takes {len(layout)} operands, got {len(operands)}")
+    fields = {"rd": None, "rs1": None, "rs2": None, "imm": None}
+    for kind, operand in zip(layout, operands):
+        if kind == "mem":
+            match = MEM_OPERAND.match(operand.replace(" ", ""))
+            if not match:
+                raise AssemblyError(line_no, f"expected imm(register), got {operand}")
+            fields["imm"] = parse_imm(line_no, op, match.group(1))
+            fields["rs1"] = parse_register(line_no, match.group(2))
+        elif kind == "target":
+            if operand in labels:
+                fields["imm"] = labels[operand] - pc
+                check_range(line_no, op, fields["imm"])
+            elif LABEL.match(operand + ":"):
+                raise AssemblyError(line_no, f"undefined label {operand}")
+            else:
+                fields["imm"] = parse_imm(line_no, op, operand)
+        elif kind == "imm":
+            fields["imm"] = parse_imm(line_no, op, operand)
+        else:
+            fields[kind] = parse_register(line_no, operand)
+    return (op, fields["rd"], fields["rs1"], fields["rs2"], fields["imm"])
+
+
+def parse(text):
+    # Returns the pre-decoded program: one (op, rd, rs1, rs2, imm) tuple per instruction
+    labels, lines = split_lines(text)
+    return [parse_instruction(line_no, op, operands, labels, pc) for pc, [line_no, op, operands] in enumerate(lines)]
+
+
+def stream_program(path):
+    # Instruction dicts of an assembly file read one line at a time, e.g. a long dynamic trace for
+    # Tomasulo's streaming mode. Labels would need the whole file first, so targets must be offsets
+    pc = 0
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            line = strip_comment(line)
+            if LABEL.match(line):
+                raise AssemblyError(line_no, "labels need the whole program, use load_program")
+            if line == "":
+                continue
+            parts = line.split(None, 1)
+            operands = [operand.strip() for operand in parts[1].split(",")] if len(parts) > 1 else []
+            yield expand([parse_instruction(line_no, parts[0].upper(), operands, {}, pc)])[0]
+            pc += 1
+
+
+def expand(program):
+    # Pre-decoded tuples -> the instruction dicts Tomasulo takes
+    instructions = []
+    for [op, rd, rs1, rs2, imm] in program:
+        instruction = {"op": op}
+        if rd != None:
+            instruction["rd"] = rd
+        if rs1 != None:
+            instruction["rs1"] = rs1
+        if rs2 != None:
+            instruction["rs2"] = rs2
+        if imm != None:
+            instruction["imm"] = imm
+        instructions.append(instruction)
+    return instructions
+
+
+def assemble(text):
+    return expand(parse(text))
+
+
+def cache_path(source, cache_dir):
+    digest = hashlib.sha256(source).hexdigest()
+    return os.path.join(cache_dir, f"{digest}.v{CACHE_VERSION}.prog")
+
+
+def write_cache_file(path, data):
+    # Write to a temporary file and rename it: atomic, so parallel sweeps never read a half-written entry.
+    # A cache only saves time, so one that cannot be written (not a directory, read-only) is skipped:
+    # returns False instead of raising
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return True
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+
+
+def load_decoded(path, cache_dir=DEFAULT_CACHE_DIR, use_cache=True):
+    # Pre-decoded program of an assembly file, parsed only when its content has not been seen before
+    with open(path, "rb") as f:
+        source = f.read()
+    if not use_cache:
+        return parse(source.decode())
+    cached = cache_path(source, cache_dir)
+    try:
+        with open(cached, "rb") as f:
+            return marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    program = parse(source.decode())
+    write_cache_file(cached, marshal.dumps(program))
+    return program
+
+
+def load_program(path, cache_dir=DEFAULT_CACHE_DIR, use_cache=True):
+    return expand(load_decoded(path, cache_dir, use_cache))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python assembler.py program.s")
+        sys.exit(1)
+    try:
+        for pc, instruction in enumerate(load_program(sys.argv[1])):
+            print(pc, instruction)
+    except AssemblyError as e:
+        print(f"{sys.argv[1]}: {e}")
+        sys.exit(1)
@@ -0,0 +1,421 @@
+# Batched lockstep simulation: one program on K machine configurations (num_rs, instruction_cycles,
+# num_cdb, issue_width, max_branches) at once. Station state, register_stat tags and countdowns of
+# every configuration live in NumPy arrays with one row per configuration, every cycle is a handful of
+# vectorized operations over all rows, and a configuration's row is dropped once it finishes.
+#
+# Only timing differs between the configurations, so register and memory values are computed once by
+# FunctionalSim instead of once per row. Its dynamic trace is the right path of every row: it gives
+# every LOAD / STORE its address and every BNE / JAL / RET the pc it goes to. With the not_taken
+# predictor a row fetches the fall-through path after every BNE, so which branches mispredict is the
+# same on every row; only how far down the wrong path each row gets before the branch writes differs,
+# and the wrong-path instructions are issued, executed and squashed per row as Tomasulo does.
+# A configuration the lockstep rows cannot model runs on Tomasulo instead (per row, the rest stay
+# batched): another predictor, whose guesses depend on the row's timing, or a reorder buffer, renaming,
+# unit pools or a smaller instruction queue. The cycle counts and counters match Tomasulo's.
+#
+# Speed: every cycle costs a few dozen array operations over all rows x station slots, so a batch is
+# nowhere near the cost of a handful of scalar runs. 2000 random configurations of a bench kernel of
+# size 300 take about as long as 120-200 event-driven Tomasulo runs for alu_stream / dep_chain /
+# branch_loop and 250-370 for mem_loop / call_loop, whose wrong paths and LOAD / STORE checks add
+# work: roughly a 5-15x saving per configuration, less for small batches or many stations.
+#
+# Example:
+#   engine = BatchTomasulo(program, [{"num_rs": var_rs, "instruction_cycles": execution_cycles},
+#                                    {"num_rs": var_rs, "instruction_cycles": execution_cycles, "num_cdb": 2}])
+#   for row in engine.run(): print(row["clock_cycles"], row["ipc"])
+
+import numpy as np
+
+from assembler import REGISTERS
+from Tom import (DecodedInstruction, FunctionalSim, INST_TYPES, Memory, OP_HANDLERS, STALL_BRANCH, STALL_JAL,
+                 STALL_NAMES, STALL_RS_FULL, STALL_WAW, TRACE_OFF, Tomasulo, check_config, write_bne, write_jal,
+                 write_load, write_redirect, write_result, write_store)
+
+NONE = -1 # no tag / no register / free station / wrong-path instruction
+BIG = np.iinfo(np.int32).max
+WRITES = (write_result, write_load, write_store, write_bne, write_jal, write_redirect)
+LOCKSTEP_KEYS = ["num_rs", "instruction_cycles", "num_cdb", "issue_width", "max_branches", "predictor"]
+
+
+def unsupported(instructions):
+    # Why the program cannot run batched, None if it can: every op has to write like a built-in one
+    for pc, instruction in enumerate(instructions):
+        handler = DecodedInstruction(instruction).handler
+        if handler.write not in WRITES or handler.complete != None:
+            return f"{instruction.get('op')} at pc {pc}: only ops that write like the built-in ones run batched"
+    return None
+
+
+class BatchTomasulo:
+    def __init__(self, instructions, configs, memory_capacity=128 * 1024, word_size=4, memory_image=None):
+        # configs: one dict of Tomasulo arguments per configuration, with num_rs and instruction_cycles.
+        # num_cdb, issue_width, max_branches and predictor="not_taken" run in lockstep, any other
+        # configuration on Tomasulo
+        reason = unsupported(instructions)
+        if reason != None:
+            raise ValueError(reason)
+        self.instructions = instructions
+        self.configs = configs
+        self.program = [DecodedInstruction(instruction) for instruction in instructions]
+        self.memory_args = {"memory_capacity": memory_capacity, "word_size": word_size, "memory_image": memory_image}
+        self.memory = Memory(memory_capacity, word_size)
+        if memory_image != None:
+            self.memory.load_image(memory_image)
+        self.decode()
+
+    def decode(self):
+        # Per instruction: type, destination and source registers. Per executed instruction (the
+        # functional model's dynamic trace): its pc, the LOAD / STORE address and the next pc
+        functional = FunctionalSim(self.program, memory=self.memory)
+        self.types = [inst for inst in INST_TYPES if any(instruction.op == inst for instruction in self.program)]
+        count = len(self.program)
+        self.op_type = np.zeros(count, dtype=np.int32) # index into self.types
+        self.dest = np.full(count, NONE, dtype=np.int32)
+        self.src_j = np.full(count, NONE, dtype=np.int32)
+        self.src_k = np.full(count, NONE, dtype=np.int32)
+        self.needs_k = np.zeros(count, dtype=bool) # k has to arrive before executing (not for STORE)
+        self.is_load = np.zeros(count, dtype=bool)
+        self.is_store = np.zeros(count, dtype=bool)
+        self.is_branch = np.zeros(count, dtype=bool)
+        self.stalls_issue = np.zeros(count, dtype=bool) # JAL / RET
+        for pc, instruction in enumerate(self.program):
+            handler = instruction.handler
+            self.op_type[pc] = self.types.index(instruction.op)
+            rd = handler.dest if handler.dest != "rd" else instruction.rd
+            if rd != None and rd != "R0": # R0 is hardwired to zero and never waited on
+                self.dest[pc] = REGISTERS.index(rd)
+            for [field, operand] in handler.sources:
+                reg = field if field in REGISTERS else getattr(instruction, field)
+                if reg == "R0":
+                    continue
+                if operand == "j":
+                    self.src_j[pc] = REGISTERS.index(reg)
+                else:
+                    self.src_k[pc] = REGISTERS.index(reg)
+            self.needs_k[pc] = "k" in handler.deps
+            self.is_load[pc] = handler.memory == "load"
+            self.is_store[pc] = handler.memory == "store"
+            self.is_branch[pc] = handler.branch
+            self.stalls_issue[pc] = handler.stalls_issue
+        pcs = []
+        address = []
+        for record in functional.trace():
+            instruction = self.program[record["pc"]]
+            pcs.append(record["pc"])
+            address.append(functional.RegFile[instruction.rs1] + instruction.imm if instruction.handler.memory != None else NONE)
+        self.trace_pc = np.array(pcs, dtype=np.int32)
+        self.address = np.array(address, dtype=np.int64)
+        self.next_pc = np.array(pcs[1:] + [functional.pc], dtype=np.int32)
+        # Fetched as not taken: the BNEs that went elsewhere
+        self.mispredicted = self.is_branch[self.trace_pc] & (self.next_pc != self.trace_pc + 1)
+        # Same final state on every configuration
+        self.RegFile = functional.RegFile
+        self.memory = functional.memory
+
+    def lockstep(self, config):
+        # Whether the configuration runs as a row of the batch rather than on Tomasulo
+        for key in config:
+            if key not in LOCKSTEP_KEYS and config[key] != None:
+                return False
+        return config.get("predictor", "not_taken") == "not_taken" or self.is_branch.any() == False
+
+    def setup(self, ids):
+        # Rows of the configurations in ids. Station slots: every used type gets as many columns as its
+        # largest configuration, a row only enables the first num_rs of them. Memory slots are the
+        # LOAD / STORE columns, branch / stall slots the BNE and JAL / RET ones.
+        configs = [self.configs[k] for k in ids]
+        rows = len(configs)
+        types = self.types
+        for config in configs: # the same checks as Tomasulo; sweep.py leaves failing points out beforehand
+            check_config(types, config["num_rs"], config["instruction_cycles"], num_cdb=config.get("num_cdb", 1),
+                         issue_width=config.get("issue_width", 1))
+        max_rs = [max(config["num_rs"][inst] for config in configs) for inst in types]
+        self.slot_type = np.repeat(np.arange(len(types)), max_rs)
+        self.type_start = (np.cumsum(max_rs) - max_rs).astype(np.int32) # a type's slots are max_rs columns from here
+        self.type_width = np.array(max_rs, dtype=np.int32)
+        self.window = np.arange(max(max_rs, default=0))
+        slot_rank = np.concatenate([np.arange(count) for count in max_rs]) if len(types) > 0 else np.zeros(0, dtype=np.int32)
+        num_rs = np.array([[config["num_rs"][inst] for inst in types] for config in configs], dtype=np.int32).reshape(rows, len(types))
+        self.latency = np.array([[config["instruction_cycles"][inst] for inst in types] for config in configs],
+                                dtype=np.int32).reshape(rows, len(types))
+        self.num_cdb = np.array([config.get("num_cdb", 1) for config in configs], dtype=np.int32)
+        self.issue_width = np.array([config.get("issue_width", 1) for config in configs], dtype=np.int32)
+        self.max_branches = np.array([config.get("max_branches", 4) for config in configs], dtype=np.int32)
+        slots = len(self.slot_type)
+        # Station state, one row per configuration; disabled slots are never free nor busy
+        self.inst = np.where(slot_rank[None, :] < num_rs[:, self.slot_type], NONE, -2).astype(np.int32)
+        self.seq = np.zeros((rows, slots), dtype=np.int32) # issue order, the age for writes and the load-store queue
+        self.dyn = np.full((rows, slots), NONE, dtype=np.int32) # position in the dynamic trace, NONE on a wrong path
+        self.qj = np.full((rows, slots), NONE, dtype=np.int32)
+        self.qk = np.full((rows, slots), NONE, dtype=np.int32)
+        self.remaining = np.zeros((rows, slots), dtype=np.int32) # 0 unless busy and still executing
+        self.k_wait = np.zeros((rows, slots), dtype=bool) # needs_k of the slot's instruction
+        self.slot_latency = self.latency[:, self.slot_type]
+        self.issue_cycle = np.zeros((rows, slots), dtype=np.int32)
+        self.execute_cycle = np.full((rows, slots), NONE, dtype=np.int32) # last execution cycle, NONE until then
+        self.register_stat = np.full((rows, len(REGISTERS)), NONE, dtype=np.int32)
+        self.glob_pc = np.zeros(rows, dtype=np.int32)
+        self.dpos = np.zeros(rows, dtype=np.int32) # next right-path position in the dynamic trace
+        self.wrong = np.zeros(rows, dtype=bool) # issuing behind a BNE that goes elsewhere
+        handlers = [OP_HANDLERS[inst] for inst in types]
+        self.mem_slots = np.nonzero([handlers[t].memory != None for t in self.slot_type])[0]
+        self.mem_is_store = np.array([handlers[t].memory == "store" for t in self.slot_type[self.mem_slots]], dtype=bool)
+        self.branch_slots = np.nonzero([handlers[t].branch for t in self.slot_type])[0]
+        self.stall_slots = np.nonzero([handlers[t].stalls_issue for t in self.slot_type])[0]
+        self.config_id = np.array(ids, dtype=np.int64) # row -> configuration, rows are dropped as they finish
+        # Counters as in RunResult, indexed by configuration rather than row
+        count = len(self.configs)
+        self.clock_cycles = np.zeros(count, dtype=np.int32) # set when the configuration finishes
+        self.issued = np.zeros(count, dtype=np.int32) # also the next instruction's seq
+        self.flushed = np.zeros(count, dtype=np.int32)
+        self.stall_cycles = np.zeros(count, dtype=np.int32)
+        self.stall_counts = np.zeros((count, len(STALL_NAMES)), dtype=np.int32)
+        self.cdb_conflicts = np.zeros(count, dtype=np.int32)
+        self.branches = np.zeros(count, dtype=np.int32)
+        self.mispredictions = np.zeros(count, dtype=np.int32)
+        self.station_cycles = np.zeros((count, len(types)), dtype=np.int32)
+        self.unit_cycles = np.zeros((count, len(types)), dtype=np.int32)
+
+    def issue_all(self, cycle):
+        # Up to issue_width in-order issues per row, a row stops at its first stall. The front end never
+        # runs dry (it refills issue_width a cycle, also after a redirect), so the instruction queue is
+        # not modelled. Each step only looks at the rows still issuing: the ones whose previous step issued
+        size = len(self.program)
+        r = np.nonzero((self.glob_pc >= 0) & (self.glob_pc < size))[0]
+        for step in range(int(self.issue_width.max())):
+            if step > 0:
+                r = r[self.issue_width[r] > step]
+                r = r[(self.glob_pc[r] >= 0) & (self.glob_pc[r] < size)]
+            if len(r) == 0:
+                break
+            pc = self.glob_pc[r]
+            dest = self.dest[pc]
+            jal = np.zeros(len(r), dtype=bool)
+            if len(self.stall_slots) > 0: # a JAL / RET has not written yet
+                jal = (self.inst[r[:, None], self.stall_slots[None, :]] >= 0).any(axis=1)
+            branch = np.zeros(len(r), dtype=bool)
+            if len(self.branch_slots) > 0:
+                unresolved = (self.inst[r[:, None], self.branch_slots[None, :]] >= 0).sum(axis=1)
+                branch = self.is_branch[pc] & (unresolved >= self.max_branches[r])
+            waw = (dest != NONE) & (self.register_stat[r, dest] != NONE)
+            # first free slot among the instruction type's columns
+            t = self.op_type[pc]
+            cols = np.minimum(self.type_start[t][:, None] + self.window[None, :], len(self.slot_type) - 1)
+            free = (self.inst[r[:, None], cols] == NONE) & (self.window[None, :] < self.type_width[t][:, None])
+            first = free.argmax(axis=1)
+            slot = self.type_start[t] + first
+            ok = ~jal & ~branch & ~waw & free[np.arange(len(r)), first]
+            if step == 0:
+                stalled = ~ok
+                ids = self.config_id[r[stalled]]
+                reason = np.where(jal, STALL_JAL, np.where(branch, STALL_BRANCH, np.where(waw, STALL_WAW, STALL_RS_FULL)))
+                self.stall_cycles[ids] += 1
+                self.stall_counts[ids, reason[stalled]] += 1
+            r = r[ok]
+            s = slot[ok]
+            pc = pc[ok]
+            self.qj[r, s] = np.where(self.src_j[pc] != NONE, self.register_stat[r, self.src_j[pc]], NONE)
+            self.qk[r, s] = np.where(self.src_k[pc] != NONE, self.register_stat[r, self.src_k[pc]], NONE)
+            writes = self.dest[pc] != NONE
+            self.register_stat[r[writes], self.dest[pc][writes]] = s[writes]
+            self.inst[r, s] = pc
+            ids = self.config_id[r]
+            self.seq[r, s] = self.issued[ids]
+            self.issued[ids] += 1
+            right = ~self.wrong[r]
+            self.dyn[r, s] = np.where(right, self.dpos[r], NONE)
+            self.wrong[r[right]] = self.mispredicted[self.dpos[r[right]]]
+            self.dpos[r[right]] += 1
+            self.remaining[r, s] = self.slot_latency[r, s]
+            self.k_wait[r, s] = self.needs_k[pc]
+            self.issue_cycle[r, s] = cycle
+            self.execute_cycle[r, s] = NONE
+            self.glob_pc[r] += 1
+
+    def execute_all(self, cycle):
+        # Every station with its operands counts down, from the cycle after it issued
+        running = ((self.remaining > 0) & (self.issue_cycle < cycle) & (self.qj == NONE)
+                   & ((self.qk == NONE) | ~self.k_wait))
+        self.remaining -= running
+        self.execute_cycle[running & (self.remaining == 0)] = cycle
+
+    def mem_blocked(self, r, s, seq):
+        # Load-store queue checks of Tomasulo.load_blocked / store_blocked (no ROB) for one candidate per row.
+        # No branch older than the candidate is unresolved, so every older LOAD / STORE is on the right path
+        slots = self.mem_slots
+        older = (self.inst[r[:, None], slots[None, :]] >= 0) & (self.seq[r[:, None], slots[None, :]] < seq[:, None])
+        unknown = self.remaining[r[:, None], slots[None, :]] == self.slot_latency[r[:, None], slots[None, :]]
+        address = self.address[np.maximum(self.dyn[r[:, None], slots[None, :]], 0)]
+        same = older & (address == self.address[self.dyn[r, s]][:, None])
+        store = self.mem_is_store[None, :]
+        # LOAD: an older STORE without an address, or the latest older STORE to its address without its value
+        latest = np.where(same & store, self.seq[r[:, None], slots[None, :]], NONE).argmax(axis=1)
+        latest_waits = (same & store)[np.arange(len(r)), latest] & (self.qk[r, slots[latest]] != NONE)
+        load_blocked = (older & store & unknown).any(axis=1) | latest_waits
+        # STORE: any older LOAD / STORE without an address or to its address, or its own value missing
+        store_blocked = (older & unknown).any(axis=1) | same.any(axis=1) | (self.qk[r, s] != NONE)
+        return np.where(self.is_store[self.inst[r, s]], store_blocked, load_blocked)
+
+    def oldest_branch(self, r):
+        # seq of each row's oldest unresolved BNE, BIG if none: nothing younger may write yet
+        if len(self.branch_slots) == 0:
+            return np.full(len(r), BIG, dtype=np.int32)
+        slots = self.branch_slots[None, :]
+        return np.where(self.inst[r[:, None], slots] >= 0, self.seq[r[:, None], slots], BIG).min(axis=1)
+
+    def write_all(self, cycle):
+        # Finished stations write oldest first: each round every row takes its oldest remaining candidate.
+        # A round only looks at the rows that still have one, usually few after the first
+        cdb = self.num_cdb.copy()
+        waiting = (self.inst >= 0) & (self.execute_cycle != NONE) & (self.execute_cycle < cycle)
+        r = np.nonzero(waiting.any(axis=1))[0]
+        while len(r) > 0:
+            oldest = self.oldest_branch(r)
+            # A row out of buses turns every remaining candidate away, but for the speculative ones
+            full = cdb[r] == 0
+            if full.any():
+                f = r[full]
+                self.cdb_conflicts[self.config_id[f]] += (waiting[f] & (self.seq[f] <= oldest[full][:, None])).sum(axis=1)
+                waiting[f] = False
+                r = r[~full]
+                oldest = oldest[~full]
+            s = np.where(waiting[r], self.seq[r], BIG).argmin(axis=1)
+            seq = self.seq[r, s]
+            # Younger than an unresolved branch: so are the rest of the row's candidates
+            speculative = seq > oldest
+            if speculative.any():
+                waiting[r[speculative]] = False
+                r = r[~speculative]
+                s = s[~speculative]
+                seq = seq[~speculative]
+            if len(r) == 0:
+                break
+            pc = self.inst[r, s]
+            waiting[r, s] = False
+            blocked = np.zeros(len(r), dtype=bool)
+            mem = self.is_load[pc] | self.is_store[pc]
+            if mem.any():
+                blocked[mem] = self.mem_blocked(r[mem], s[mem], seq[mem])
+            writes = ~blocked
+            broadcasts = writes & ~self.is_store[pc]
+            cdb[r[broadcasts]] -= 1
+            self.broadcast(r[broadcasts], s[broadcasts])
+            w = r[writes]
+            s = s[writes]
+            pc = pc[writes]
+            control = self.is_branch[pc] | self.stalls_issue[pc]
+            if control.any():
+                self.resolve(w[control], s[control], pc[control], waiting, cycle)
+            # empty the written stations
+            ids = self.config_id[w]
+            types = self.slot_type[s]
+            self.station_cycles[ids, types] += cycle - self.issue_cycle[w, s] + 1
+            self.unit_cycles[ids, types] += self.slot_latency[w, s]
+            self.inst[w, s] = NONE
+            r = r[waiting[r].any(axis=1)]
+
+    def resolve(self, r, s, pc, waiting, cycle):
+        # A BNE / JAL / RET of each row r writes. A BNE that went elsewhere squashes everything issued
+        # after it; then it, a JAL or a RET sends the row to the next pc of its dynamic trace position
+        dyn = self.dyn[r, s]
+        branch = self.is_branch[pc]
+        self.branches[self.config_id[r[branch]]] += 1
+        missed = branch & self.mispredicted[dyn]
+        self.mispredictions[self.config_id[r[missed]]] += 1
+        if missed.any():
+            self.squash(r[missed], self.seq[r[missed], s[missed]], waiting, cycle)
+        redirect = missed | self.stalls_issue[pc]
+        r = r[redirect]
+        dyn = dyn[redirect]
+        self.glob_pc[r] = self.next_pc[dyn]
+        self.dpos[r] = dyn + 1
+        self.wrong[r] = False
+
+    def squash(self, r, seq, waiting, cycle):
+        # Empty every station of row r issued after seq; none of them has written anything
+        younger = (self.inst[r] >= 0) & (self.seq[r] > seq[:, None])
+        [rows, slots] = np.nonzero(younger)
+        w = r[rows]
+        ids = self.config_id[w]
+        types = self.slot_type[slots]
+        self.flushed[self.config_id[r]] += younger.sum(axis=1)
+        np.add.at(self.station_cycles, (ids, types), cycle - self.issue_cycle[w, slots] + 1)
+        np.add.at(self.unit_cycles, (ids, types), self.slot_latency[w, slots] - self.remaining[w, slots])
+        stat = self.register_stat[r]
+        gone = (stat >= 0) & np.take_along_axis(younger, np.maximum(stat, 0), axis=1)
+        self.register_stat[r] = np.where(gone, NONE, stat)
+        self.inst[w, slots] = NONE
+        self.remaining[w, slots] = 0
+        waiting[w, slots] = False
+
+    def broadcast(self, r, s):
+        # Result of station s of each row r on the CDB: clear register_stat and every qj / qk waiting on it
+        tag = s[:, None]
+        stat = self.register_stat[r]
+        self.register_stat[r] = np.where(stat == tag, NONE, stat)
+        qj = self.qj[r]
+        self.qj[r] = np.where(qj == tag, NONE, qj)
+        qk = self.qk[r]
+        self.qk[r] = np.where(qk == tag, NONE, qk)
+
+    def drop(self, keep):
+        # Remove the rows of finished configurations from every per-row array
+        for name in ("inst", "seq", "dyn", "qj", "qk", "remaining", "k_wait", "slot_latency", "issue_cycle", "execute_cycle",
+                     "register_stat", "glob_pc", "dpos", "wrong", "num_cdb", "issue_width", "max_branches", "config_id"):
+            setattr(self, name, getattr(self, name)[keep])
+
+    def run(self):
+        # Simulate every configuration to the end; returns one RunResult.as_dict() style row per configuration
+        rows = [None] * len(self.configs)
+        ids = []
+        for k in range(len(self.configs)):
+            if self.lockstep(self.configs[k]) == True:
+                ids.append(k)
+            else:
+                tomasulo = Tomasulo(self.instructions, event_driven=True, trace_level=TRACE_OFF, **self.memory_args,
+                                    **self.configs[k])
+                rows[k] = tomasulo.run().as_dict()
+        if len(ids) == 0:
+            return rows
+        self.setup(ids)
+        size = len(self.program)
+        cycle = 0
+        while len(self.config_id) > 0:
+            cycle += 1
+            self.issue_all(cycle)
+            self.execute_all(cycle)
+            self.write_all(cycle)
+            done = ((self.glob_pc < 0) | (self.glob_pc >= size)) & ~(self.inst >= 0).any(axis=1)
+            if done.any():
+                self.clock_cycles[self.config_id[done]] = cycle
+                self.drop(~done)
+        for k in ids:
+            rows[k] = self.row(k)
+        return rows
+
+    def row(self, k):
+        # Same keys and order as RunResult.as_dict()
+        config = self.configs[k]
+        cycles = int(self.clock_cycles[k])
+        count = int(self.issued[k] - self.flushed[k])
+        row = {"clock_cycles": cycles, "instructions": count, "issued": int(self.issued[k]), "flushed": int(self.flushed[k]),
+               "ipc": count / cycles if cycles > 0 else 0.0, "stall_cycles": int(self.stall_cycles[k])}
+        for reason, name in enumerate(STALL_NAMES):
+            row["stall_" + name] = int(self.stall_counts[k, reason])
+        row["cdb_conflicts"] = int(self.cdb_conflicts[k])
+        row["fu_conflicts"] = 0
+        row["branches"] = int(self.branches[k])
+        row["mispredictions"] = int(self.mispredictions[k])
+        row["accuracy"] = 1 - row["mispredictions"] / row["branches"] if row["branches"] > 0 else None
+        busy = {inst: 0 for inst in INST_TYPES}
+        executing = {inst: 0 for inst in INST_TYPES}
+        for t, inst in enumerate(self.types):
+            busy[inst] = int(self.station_cycles[k, t])
+            executing[inst] = int(self.unit_cycles[k, t])
+        for inst in INST_TYPES:
+            capacity = config["num_rs"].get(inst, 0) * cycles
+            row["occupancy_" + inst] = busy[inst] / capacity if capacity > 0 else 0.0
+        for inst in INST_TYPES:
+            capacity = config["num_rs"].get(inst, 0) * cycles
+            row["utilization_" + inst] = executing[inst] / capacity if capacity > 0 else 0.0
+        return row
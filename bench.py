@@ -0,0 +1,217 @@
+# Benchmark suite: synthetic kernels of scalable length, run on Tomasulo to report simulated
+# cycles and host simulation speed. Saving a run with --save and passing it back with --compare
+# prints the speedup of every kernel, so engine changes show up as numbers.
+#
+# Example:
+#   python bench.py --size 2000 --save before.json
+#   python bench.py --size 2000 --compare before.json
+#   python bench.py --size 2000 --rs 4 --widths 1,2,4      # throughput gain of wider issue
+#   python bench.py --kernel call_loop --rob 16            # JAL / RET predicted instead of stalling
+#   python bench.py --kernel alu_stream --widths 1,2,4 --phys-regs 32
+
+import argparse
+import json
+import time
+
+from Tom import FunctionalSim, PREDICTORS, Tomasulo, TRACE_OFF, var_rs, execution_cycles
+
+REGS = ["R1", "R2", "R3", "R4", "R5", "R6", "R7"]
+
+
+def load_const(reg, value):
+    # reg = value (>= 0) using only 5-bit immediates: octal digits shifted in by R7 = 3.
+    # R7 is used as the shift amount, so reg must not be R7
+    program = [{"op": "ADDI", "rd": "R7", "rs1": "R0", "imm": 3},
+               {"op": "ADDI", "rd": reg, "rs1": "R0", "imm": 0}]
+    for digit in oct(value)[2:]:
+        program.append({"op": "SLL", "rd": reg, "rs1": reg, "rs2": "R7"})
+        program.append({"op": "ADDI", "rd": reg, "rs1": reg, "imm": int(digit)})
+    return program
+
+
+def dep_chain(n):
+    # n ADDIs, each reading the result of the one before it
+    program = []
+    for i in range(n):
+        program.append({"op": "ADDI", "rd": REGS[(i + 1) % 7], "rs1": REGS[i % 7], "imm": 1})
+    return program
+
+
+def alu_stream(n):
+    # n independent ALU operations spread over every arithmetic unit
+    ops = ["ADD", "ADDI", "NAND", "NEG", "SLL"]
+    program = []
+    for i in range(n):
+        op = ops[i % len(ops)]
+        instruction = {"op": op, "rd": REGS[i % 7], "rs1": "R0"}
+        if op == "ADDI":
+            instruction["imm"] = i % 16
+        elif op != "NEG":
+            instruction["rs2"] = "R0"
+        program.append(instruction)
+    return program
+
+
+def mem_loop(n):
+    # Read-modify-write over a 16-word buffer, about n LOAD/STORE iterations (rounded up to 16)
+    program = load_const("R2", max(1, (n + 15) // 16)) # outer counter
+    program += [
+        {"op": "ADDI", "rd": "R1", "rs1": "R0", "imm": 0}, # outer: address = 0
+        {"op": "ADDI", "rd": "R4", "rs1": "R0", "imm": 15},
+        {"op": "ADDI", "rd": "R4", "rs1": "R4", "imm": 1}, # inner counter = 16
+        {"op": "LOAD", "rd": "R3", "rs1": "R1", "imm": 0}, # inner:
+        {"op": "ADDI", "rd": "R3", "rs1": "R3", "imm": 1},
+        {"op": "STORE", "rs1": "R1", "rs2": "R3", "imm": 0},
+        {"op": "ADDI", "rd": "R1", "rs1": "R1", "imm": 4},
+        {"op": "ADDI", "rd": "R4", "rs1": "R4", "imm": -1},
+        {"op": "BNE", "rs1": "R4", "rs2": "R0", "imm": -5}, # to inner
+        {"op": "ADDI", "rd": "R2", "rs1": "R2", "imm": -1},
+        {"op": "BNE", "rs1": "R2", "rs2": "R0", "imm": -10} # to outer
+    ]
+    return program
+
+
+def branch_loop(n):
+    # n iterations of a two-instruction counted loop
+    program = load_const("R2", n)
+    program += [
+        {"op": "ADDI", "rd": "R2", "rs1": "R2", "imm": -1},
+        {"op": "BNE", "rs1": "R2", "rs2": "R0", "imm": -1}
+    ]
+    return program
+
+
+def call_loop(n):
+    # n calls of a two-instruction function
+    program = load_const("R2", n)
+    program += [
+        {"op": "JAL", "imm": 4}, # loop: call func
+        {"op": "ADDI", "rd": "R2", "rs1": "R2", "imm": -1},
+        {"op": "BNE", "rs1": "R2", "rs2": "R0", "imm": -2}, # to loop
+        {"op": "JAL", "imm": 3}, # to the end, past func
+        {"op": "ADD", "rd": "R4", "rs1": "R4", "rs2": "R5"}, # func:
+        {"op": "RET"}
+    ]
+    return program
+
+
+KERNELS = {
+    "dep_chain": dep_chain,
+    "alu_stream": alu_stream,
+    "mem_loop": mem_loop,
+    "branch_loop": branch_loop,
+    "call_loop": call_loop
+}
+
+
+def bench_kernel(name, size, num_rs=var_rs, instruction_cycles=execution_cycles, event_driven=False, repeat=3, num_cdb=1,
+                 issue_width=1, predictor="not_taken", rob_size=None, num_phys_regs=None):
+    # Best host time of `repeat` runs; the final state is checked against the functional model
+    program = KERNELS[name](size)
+    best = None
+    for r in range(repeat):
+        tomasulo = Tomasulo(program, num_rs=num_rs, instruction_cycles=instruction_cycles,
+                            event_driven=event_driven, trace_level=TRACE_OFF, num_cdb=num_cdb, issue_width=issue_width,
+                            predictor=predictor, rob_size=rob_size, num_phys_regs=num_phys_regs)
+        start = time.perf_counter()
+        result = tomasulo.run()
+        seconds = time.perf_counter() - start
+        if best == None or seconds < best:
+            best = seconds
+    functional = FunctionalSim(program)
+    functional.run()
+    correct = functional.RegFile == tomasulo.RegFile and bytes(functional.memory.data) == bytes(tomasulo.memory.data)
+    return {
+        "kernel": name,
+        "size": size,
+        "instructions": result.instructions,
+        "clock_cycles": result.clock_cycles,
+        "ipc": result.ipc,
+        "accuracy": result.accuracy,
+        "host_seconds": best,
+        "host_ips": result.instructions / best if best > 0 else None, # simulated instructions per host second
+        "host_cps": result.clock_cycles / best if best > 0 else None, # simulated cycles per host second
+        "correct": correct
+    }
+
+
+def run_suite(kernels, sizes, event_driven=False, repeat=3, num_cdb=1, issue_width=1, num_rs=var_rs, predictor="not_taken",
+              rob_size=None, num_phys_regs=None):
+    rows = []
+    for name in kernels:
+        for size in sizes:
+            rows.append(bench_kernel(name, size, num_rs=num_rs, event_driven=event_driven, repeat=repeat,
+                                     num_cdb=num_cdb, issue_width=issue_width, predictor=predictor, rob_size=rob_size,
+                                     num_phys_regs=num_phys_regs))
+    return rows
+
+
+def width_scaling(kernels, sizes, widths, num_cdb=1, num_rs=var_rs, predictor="not_taken", rob_size=None,
+                  num_phys_regs=None):
+    # Simulated cycles of every kernel at each issue width, and the speedup over the first width
+    print(f"{'kernel':<12} {'size':>7} " + " ".join(f"{'w=' + str(width):>16}" for width in widths))
+    for name in kernels:
+        for size in sizes:
+            cycles = [bench_kernel(name, size, num_rs=num_rs, repeat=1, num_cdb=num_cdb, issue_width=width,
+                                   predictor=predictor, rob_size=rob_size, num_phys_regs=num_phys_regs)["clock_cycles"]
+                      for width in widths]
+            cells = [f"{count:>8} {cycles[0] / count:>6.2f}x" for count in cycles]
+            print(f"{name:<12} {size:>7} " + " ".join(f"{cell:>16}" for cell in cells))
+
+
+def print_rows(rows, baseline=None):
+    header = f"{'kernel':<12} {'size':>7} {'instrs':>8} {'cycles':>9} {'ipc':>6} {'bp acc':>6} {'host s':>9} {'instr/s':>10} {'cycles/s':>10}"
+    if baseline != None:
+        header += f" {'speedup':>8}"
+    print(header)
+    for row in rows:
+        line = (f"{row['kernel']:<12} {row['size']:>7} {row['instructions']:>8} {row['clock_cycles']:>9} "
+                f"{row['ipc']:>6.3f} {'-' if row['accuracy'] == None else format(row['accuracy'], '.3f'):>6} {row['host_seconds']:>9.4f} {row['host_ips']:>10.0f} {row['host_cps']:>10.0f}")
+        if baseline != None:
+            old = baseline.get((row["kernel"], row["size"]))
+            line += f" {old['host_seconds'] / row['host_seconds']:>7.2f}x" if old != None else f" {'-':>8}"
+            if old != None and old["clock_cycles"] != row["clock_cycles"]:
+                line += f"  (cycles were {old['clock_cycles']})"
+        if row["correct"] == False:
+            line += "  WRONG RESULT"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Tomasulo on synthetic kernels")
+    parser.add_argument("--kernel", action="append", choices=list(KERNELS), help="kernel to run (default: all)")
+    parser.add_argument("--size", type=int, action="append", help="kernel length / iterations (default: 200 and 2000)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per kernel, the fastest one is reported")
+    parser.add_argument("--cdb", type=int, default=1, help="number of common data buses")
+    parser.add_argument("--issue-width", type=int, default=1, help="instructions issued per cycle")
+    parser.add_argument("--widths", help="comma separated issue widths: print the cycles and speedup of each instead")
+    parser.add_argument("--predictor", default="not_taken", choices=list(PREDICTORS), help="branch predictor")
+    parser.add_argument("--rob", type=int, help="reorder buffer entries (default: no reorder buffer)")
+    parser.add_argument("--phys-regs", type=int, help="physical registers to rename onto (default: no renaming)")
+    parser.add_argument("--rs", type=int, help="reservation stations of every type (default: var_rs from Tom.py)")
+    parser.add_argument("--event-driven", action="store_true", help="use the event-driven clock")
+    parser.add_argument("--save", help="write the results to a JSON file")
+    parser.add_argument("--compare", help="JSON file from an earlier --save to compute speedups against")
+    args = parser.parse_args()
+
+    kernels = args.kernel or list(KERNELS)
+    sizes = args.size or [200, 2000]
+    num_rs = {inst: args.rs for inst in var_rs} if args.rs else var_rs
+    if args.widths:
+        width_scaling(kernels, sizes, [int(width) for width in args.widths.split(",")], args.cdb, num_rs, args.predictor, args.rob,
+                      args.phys_regs)
+        return
+    rows = run_suite(kernels, sizes, args.event_driven, args.repeat, args.cdb, args.issue_width, num_rs,
+                     args.predictor, args.rob, args.phys_regs)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {(row["kernel"], row["size"]): row for row in json.load(f)}
+    print_rows(rows, baseline)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
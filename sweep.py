@@ -0,0 +1,249 @@
+# Design-space sweep: runs one program over many num_rs / instruction_cycles combinations
+# on a process pool and streams one result row per configuration to a CSV or JSONL file.
+#
+# Example:
+#   python sweep.py --rs ADD=1:4 --cycles ADD=2,4,8 --cycles LOAD=1:3 --cdb 1:2 --issue-width 1,2,4 --predictor not_taken,gshare --rob 8,16 --out results.csv
+#   python sweep.py --rs ADD=4 --fus ADD=1:2 --interval ADD=1,8 --out units.csv
+#   python sweep.py --rs ADD=1:4 --cache --out results.csv      # points simulated by an earlier sweep are not re-run
+#   python sweep.py --program kernel.s --rs ADD=1:8 --cycles ADD=1:16 --cycles LOAD=1:16 --batch --out grid.csv
+#
+# --batch runs the points on batch.py's NumPy engine instead of the pool: thousands of configurations
+# are simulated in lockstep, batch_size at a time (the ones with a predictor other than not_taken on
+# Tomasulo, one after the other).
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+from Tom import (DEFAULT_RESULT_CACHE_DIR, INST_TYPES, PREDICTORS, ResultCache, RunResult, Tomasulo, TRACE_OFF,
+                 check_config, instructions, read_program, var_rs, execution_cycles)
+
+# Set once per worker by init_worker so the program is not pickled with every point
+worker_program = None
+worker_cache = None
+
+
+def axis(ranges, base, inst, what):
+    # Values of one type's axis: its range, or else its base value (an op added with register_op may have none)
+    if inst in ranges:
+        return list(ranges[inst])
+    if inst in base:
+        return [base[inst]]
+    raise ValueError(f"No {what} for {inst}: give it a range")
+
+
+def expand_points(rs_ranges, cycle_ranges, cdb_range=[1], width_range=[1], predictors=["not_taken"], rob_range=[None],
+                  phys_range=[None], fu_ranges={}, interval_ranges={}, base_rs=var_rs, base_cycles=execution_cycles):
+    # Cartesian product of every range; types without a range keep their base value. Functional unit
+    # pools are only used when a unit count or initiation interval range is given for some type
+    rs_axes = [axis(rs_ranges, base_rs, inst, "reservation station count") for inst in INST_TYPES]
+    cycle_axes = [axis(cycle_ranges, base_cycles, inst, "execution cycles") for inst in INST_TYPES]
+    fu_types = list(fu_ranges)
+    interval_types = list(interval_ranges)
+    fu_axes = [list(fu_ranges[inst]) for inst in fu_types] + [list(interval_ranges[inst]) for inst in interval_types]
+    other_axes = [list(cdb_range), list(width_range), list(predictors), list(rob_range), list(phys_range)]
+    for point_id, values in enumerate(itertools.product(*(rs_axes + cycle_axes + fu_axes + other_axes))):
+        num_rs = dict(zip(INST_TYPES, values[:len(INST_TYPES)]))
+        cycles = dict(zip(INST_TYPES, values[len(INST_TYPES):2 * len(INST_TYPES)]))
+        rest = values[2 * len(INST_TYPES):]
+        num_fus = None
+        intervals = None
+        if len(fu_axes) > 0:
+            num_fus = dict(zip(fu_types, rest))
+            intervals = dict(zip(interval_types, rest[len(fu_types):]))
+        yield [point_id, num_rs, cycles, num_fus, intervals] + list(rest[len(fu_axes):])
+
+
+def init_worker(program, cache_dir=None, cache_bytes=256 << 20):
+    global worker_program, worker_cache
+    worker_program = program
+    if cache_dir != None:
+        worker_cache = ResultCache(cache_dir, cache_bytes)
+
+
+def point_row(point):
+    # The configuration columns of a result row
+    [point_id, num_rs, cycles, num_fus, intervals, num_cdb, issue_width, predictor, rob_size, num_phys_regs] = point
+    row = {"point": point_id}
+    for inst in INST_TYPES:
+        row["rs_" + inst] = num_rs[inst]
+    for inst in INST_TYPES:
+        row["cycles_" + inst] = cycles[inst]
+    for inst in num_fus or {}:
+        row["fus_" + inst] = num_fus[inst]
+    for inst in intervals or {}:
+        row["interval_" + inst] = intervals[inst]
+    row["num_cdb"] = num_cdb
+    row["issue_width"] = issue_width
+    row["predictor"] = predictor
+    row["rob_size"] = rob_size
+    row["num_phys_regs"] = num_phys_regs
+    return row
+
+
+def error_row(point, error, seconds):
+    row = point_row(point)
+    for column in RunResult.columns():
+        row[column] = None
+    row["error"] = error
+    row["host_seconds"] = seconds
+    return row
+
+
+def run_point(point):
+    [point_id, num_rs, cycles, num_fus, intervals, num_cdb, issue_width, predictor, rob_size, num_phys_regs] = point
+    row = point_row(point)
+    start = time.perf_counter()
+    try:
+        tomasulo = Tomasulo(worker_program, num_rs=num_rs, instruction_cycles=cycles,
+                            event_driven=True, trace_level=TRACE_OFF, num_cdb=num_cdb,
+                            issue_width=issue_width, predictor=predictor, rob_size=rob_size,
+                            num_phys_regs=num_phys_regs, num_fus=num_fus, initiation_interval=intervals,
+                            result_cache=worker_cache)
+        row.update(tomasulo.run().as_dict())
+        row["error"] = ""
+    except Exception as e: # one broken configuration should not stop the sweep
+        return error_row(point, f"{type(e).__name__}: {e}", time.perf_counter() - start)
+    row["host_seconds"] = time.perf_counter() - start
+    return row
+
+
+def run_batch(program, points, batch_size=4096):
+    # Rows of every point from BatchTomasulo, batch_size configurations per lockstep run. A point that
+    # fails check_config gets its error row and is left out of the batch. NumPy is only needed here,
+    # so it is imported here
+    from batch import BatchTomasulo, unsupported
+    reason = unsupported(program)
+    if reason != None:
+        raise ValueError(reason)
+    ops = set(instruction.get("op") for instruction in program)
+    points = iter(points)
+    while True:
+        chunk = list(itertools.islice(points, batch_size))
+        if len(chunk) == 0:
+            return
+        for point in chunk:
+            [point_id, num_rs, cycles, num_fus, intervals, num_cdb, issue_width, predictor, rob_size, num_phys_regs] = point
+            if num_fus != None or intervals != None or rob_size != None or num_phys_regs != None:
+                raise ValueError("--batch does not model functional unit pools, a reorder buffer or renaming")
+        valid = []
+        for point in chunk:
+            try:
+                check_config(ops, point[1], point[2], num_cdb=point[5], issue_width=point[6])
+                valid.append(point)
+            except ValueError as e:
+                yield error_row(point, f"{type(e).__name__}: {e}", 0.0)
+        chunk = valid
+        if len(chunk) == 0:
+            continue
+        configs = [{"num_rs": point[1], "instruction_cycles": point[2], "num_cdb": point[5], "issue_width": point[6],
+                    "predictor": point[7]} for point in chunk]
+        start = time.perf_counter()
+        try:
+            results = BatchTomasulo(program, configs).run()
+        except Exception as e: # the program itself faults, the same on every configuration
+            seconds = (time.perf_counter() - start) / len(chunk)
+            for point in chunk:
+                yield error_row(point, f"{type(e).__name__}: {e}", seconds)
+            continue
+        seconds = (time.perf_counter() - start) / len(chunk) # host time is shared by the whole batch
+        for point, result in zip(chunk, results):
+            row = point_row(point)
+            row.update(result)
+            row["error"] = ""
+            row["host_seconds"] = seconds
+            yield row
+
+
+def sweep(program, rs_ranges, cycle_ranges, out_path, workers=None, chunksize=4, cdb_range=[1], width_range=[1],
+          predictors=["not_taken"], rob_range=[None], phys_range=[None], fu_ranges={}, interval_ranges={}, batch=False,
+          batch_size=4096, cache_dir=None, cache_bytes=256 << 20):
+    # Rows are written in completion order, so a partial file is usable while the sweep runs
+    workers = workers or os.cpu_count() or 1
+    jsonl = out_path.endswith(".jsonl")
+    done = 0
+    points = expand_points(rs_ranges, cycle_ranges, cdb_range, width_range, predictors, rob_range, phys_range,
+                           fu_ranges, interval_ranges)
+    with open(out_path, "w", newline="") as out:
+        writer = None
+        pool = None
+        if batch == True:
+            rows = run_batch(program, points, batch_size)
+        else:
+            pool = multiprocessing.Pool(workers, initializer=init_worker, initargs=(program, cache_dir, cache_bytes))
+            rows = pool.imap_unordered(run_point, points, chunksize)
+        try:
+            for row in rows:
+                if jsonl:
+                    out.write(json.dumps(row) + "\n")
+                else:
+                    if writer == None:
+                        writer = csv.DictWriter(out, fieldnames=list(row.keys()))
+                        writer.writeheader()
+                    writer.writerow(row)
+                out.flush()
+                done += 1
+        finally:
+            if pool != None:
+                pool.terminate()
+    return done
+
+
+def parse_range(text):
+    # "3" -> [3], "1:4" -> [1, 2, 3, 4], "1:9:2" -> [1, 3, 5, 7, 9], "2,4,8" -> [2, 4, 8]
+    if ":" in text:
+        parts = [int(part) for part in text.split(":")]
+        step = parts[2] if len(parts) == 3 else 1
+        return list(range(parts[0], parts[1] + 1, step))
+    return [int(part) for part in text.split(",")]
+
+
+def parse_ranges(specs):
+    ranges = {}
+    for spec in specs or []:
+        [inst, values] = spec.split("=")
+        inst = inst.upper()
+        if inst not in INST_TYPES:
+            raise ValueError(f"Unknown instruction type {inst}")
+        ranges[inst] = parse_range(values)
+    return ranges
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep reservation station counts and execution cycles")
+    parser.add_argument("--program", help="assembly file, or JSON file with the instruction list (default: the example in Tom.py)")
+    parser.add_argument("--rs", action="append", help="TYPE=range of reservation stations, e.g. ADD=1:4")
+    parser.add_argument("--cycles", action="append", help="TYPE=range of execution cycles, e.g. ADD=2,4,8")
+    parser.add_argument("--fus", action="append", help="TYPE=range of functional units shared by its stations, e.g. ADD=1:2")
+    parser.add_argument("--interval", action="append", help="TYPE=range of unit initiation intervals, e.g. ADD=1,4 (1: pipelined)")
+    parser.add_argument("--cdb", default="1", help="range of common data bus counts, e.g. 1:3")
+    parser.add_argument("--issue-width", default="1", help="range of issue widths, e.g. 1,2,4")
+    parser.add_argument("--predictor", default="not_taken", help="comma separated branch predictors: " + ", ".join(PREDICTORS))
+    parser.add_argument("--rob", help="range of reorder buffer sizes, e.g. 8,16,32 (default: no reorder buffer)")
+    parser.add_argument("--phys-regs", help="range of physical register counts for renaming, e.g. 12:32:4 (default: no renaming)")
+    parser.add_argument("--out", default="sweep.csv", help="output file, .csv or .jsonl")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--cache", nargs="?", const=DEFAULT_RESULT_CACHE_DIR,
+                        help="reuse results of configurations simulated before, kept in this directory (default: ~/.cache/tomasulo/results)")
+    parser.add_argument("--cache-mb", type=int, default=256, help="size cap of the result cache, least recently used entries go first")
+    parser.add_argument("--batch", action="store_true", help="simulate the points on the NumPy lockstep engine")
+    parser.add_argument("--batch-size", type=int, default=4096, help="configurations per lockstep batch")
+    args = parser.parse_args()
+
+    program = read_program(args.program) if args.program else instructions
+    start = time.perf_counter()
+    count = sweep(program, parse_ranges(args.rs), parse_ranges(args.cycles), args.out, args.workers,
+                  cdb_range=parse_range(args.cdb), width_range=parse_range(args.issue_width),
+                  predictors=args.predictor.split(","), rob_range=parse_range(args.rob) if args.rob else [None],
+                  phys_range=parse_range(args.phys_regs) if args.phys_regs else [None],
+                  fu_ranges=parse_ranges(args.fus), interval_ranges=parse_ranges(args.interval), batch=args.batch,
+                  batch_size=args.batch_size, cache_dir=args.cache, cache_bytes=args.cache_mb << 20)
+    print(f"{count} configurations written to {args.out} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
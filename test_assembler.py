@@ -0,0 +1,72 @@
+# Assembler parsing and the compiled-program cache: python -m pytest test_assembler.py
+
+import pytest
+
+import assembler
+from assembler import AssemblyError, assemble, load_program
+
+LOOP = """
+        ADDI R1, R0, 3
+loop:   ADDI R1, R1, -1     # count down
+        BNE  R1, R0, loop
+        JAL  end
+        NEG  R2, R1
+end:    LOAD R3, 4(R1)
+"""
+
+
+def test_labels_resolve_pc_relative():
+    program = assemble(LOOP)
+    assert program[2] == {"op": "BNE", "rs1": "R1", "rs2": "R0", "imm": -1}
+    assert program[3] == {"op": "JAL", "imm": 2}
+    assert program[5] == {"op": "LOAD", "rd": "R3", "rs1": "R1", "imm": 4}
+
+
+@pytest.mark.parametrize("text", [
+    "ADDI R1, R0, 16", # 5-bit immediates are -16..15
+    "ADDI R1, R0, -17",
+    "LOAD R1, 16(R0)",
+    "JAL 64"
+])
+def test_immediate_out_of_range(text):
+    with pytest.raises(AssemblyError):
+        assemble(text)
+
+
+@pytest.mark.parametrize("text", ["ADD R1, R8, R2", "NEG R1, X2", "STORE R1, 0(R9)"])
+def test_bad_register(text):
+    with pytest.raises(AssemblyError):
+        assemble(text)
+
+
+@pytest.mark.parametrize("text", ["BNE R1, R0, nowhere", "MUL R1, R2, R3", "ADD R1, R2", "a:\na: ADD R1, R2, R3"])
+def test_bad_program(text):
+    with pytest.raises(AssemblyError):
+        assemble(text)
+
+
+def test_cache_hit_and_miss(tmp_path, monkeypatch):
+    source = tmp_path / "loop.s"
+    source.write_text(LOOP)
+    cache_dir = tmp_path / "cache"
+    expected = assemble(LOOP)
+    assert load_program(str(source), str(cache_dir)) == expected # miss: parsed and stored
+    assert len(list(cache_dir.iterdir())) == 1
+
+    def no_parse(text):
+        raise AssertionError("parsed again on a cache hit")
+    monkeypatch.setattr(assembler, "parse", no_parse)
+    assert load_program(str(source), str(cache_dir)) == expected # hit
+    source.write_text(LOOP + "ADD R1, R1, R1\n")
+    monkeypatch.undo()
+    assert len(load_program(str(source), str(cache_dir))) == len(expected) + 1 # changed source: miss
+    assert len(list(cache_dir.iterdir())) == 2
+
+
+def test_unusable_cache_dir(tmp_path):
+    source = tmp_path / "loop.s"
+    source.write_text(LOOP)
+    not_a_dir = tmp_path / "file"
+    not_a_dir.write_text("")
+    assert load_program(str(source), str(not_a_dir)) == assemble(LOOP)
+    assert load_program(str(source), str(not_a_dir / "sub")) == assemble(LOOP)
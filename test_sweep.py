@@ -0,0 +1,49 @@
+# Sweep point expansion and rows: python -m pytest test_sweep.py
+
+import pytest
+
+import sweep
+from Tom import INST_TYPES, OPCODES, OP_HANDLERS, OpHandler, register_op, var_rs, execution_cycles
+
+
+def execute_mul(sim, station):
+    station.result = station.vj * station.vk
+
+
+@pytest.fixture
+def mul():
+    # A MUL op registered for the test only, with no var_rs / execution_cycles entry
+    register_op(OpHandler("MUL", [["rs1", "j"], ["rs2", "k"]], dest="rd", execute=execute_mul,
+                          write=OP_HANDLERS["ADD"].write))
+    yield "MUL"
+    del OP_HANDLERS["MUL"]
+    del OPCODES["MUL"]
+    INST_TYPES.remove("MUL")
+
+
+def test_registered_op_gets_axes(mul):
+    points = list(sweep.expand_points({"MUL": [1, 2]}, {"MUL": [2]}))
+    assert [point[1]["MUL"] for point in points] == [1, 2]
+    assert all(point[2]["MUL"] == 2 for point in points)
+    assert "rs_MUL" in sweep.point_row(points[0])
+
+
+def test_registered_op_without_range_raises(mul):
+    with pytest.raises(ValueError):
+        list(sweep.expand_points({"MUL": [1]}, {}))
+
+
+def test_registered_op_runs(mul):
+    sweep.worker_program = [{"op": "MUL", "rd": "R1", "rs1": "R2", "rs2": "R3"}]
+    rows = [sweep.run_point(point) for point in sweep.expand_points({"MUL": [1, 2]}, {"MUL": [2, 3]})]
+    assert [row["error"] for row in rows] == ["", "", "", ""]
+    cycles = {(row["rs_MUL"], row["cycles_MUL"]): row["clock_cycles"] for row in rows}
+    assert cycles[(1, 3)] == cycles[(1, 2)] + 1
+    assert cycles[(2, 3)] == cycles[(2, 2)] + 1
+
+
+def test_bad_point_gets_error_row():
+    sweep.worker_program = [{"op": "ADD", "rd": "R1", "rs1": "R2", "rs2": "R3"}]
+    rows = [sweep.run_point(point) for point in sweep.expand_points({}, {"ADD": [0, 1]})]
+    assert rows[0]["error"].startswith("ValueError")
+    assert rows[1]["error"] == "" and rows[1]["clock_cycles"] > 0
@@ -0,0 +1,147 @@
+# Engine equivalence checks: python -m pytest test_tomasulo.py
+#
+# The event-driven clock, checkpoints and batch.py all promise the same results as the plain
+# cycle-by-cycle Tomasulo run, which itself has to end in the same state as FunctionalSim.
+
+import json
+
+import pytest
+
+import bench
+import Tom
+from Tom import FunctionalSim, ListSink, ResultCache, Tomasulo, TRACE_EVENTS, TRACE_OFF, var_rs, execution_cycles
+
+SIZE = 40
+
+# Engine modes every kernel runs in, as extra Tomasulo arguments
+MODES = {
+    "base": {},
+    "wide": {"issue_width": 2, "num_cdb": 2},
+    "gshare": {"predictor": "gshare"},
+    "rob": {"rob_size": 8},
+    "rename": {"rob_size": 8, "num_phys_regs": 16},
+    "rename_no_rob": {"num_phys_regs": 16},
+    "units": {"num_fus": {"ADD": 1, "ADDI": 1}, "initiation_interval": {"ADDI": 2}}
+}
+
+
+def run(program, event_driven, **kwargs):
+    # RunResult row, issue / write trace lines and the final simulator
+    sink = ListSink()
+    tomasulo = Tomasulo(program, var_rs, execution_cycles, event_driven=event_driven, trace_level=TRACE_EVENTS,
+                        trace_sink=sink, **kwargs)
+    result = tomasulo.run().as_dict()
+    events = [line for line in sink.lines if line.startswith("I was issued") or "am writing" in line]
+    return result, events, tomasulo
+
+
+@pytest.mark.parametrize("mode", list(MODES))
+@pytest.mark.parametrize("kernel", list(bench.KERNELS))
+def test_event_driven_matches_cycle_by_cycle(kernel, mode):
+    program = bench.KERNELS[kernel](SIZE)
+    [result, events, tomasulo] = run(program, False, **MODES[mode])
+    [skipped, skipped_events, event_tomasulo] = run(program, True, **MODES[mode])
+    assert skipped == result
+    assert len(events) > 0
+    assert skipped_events == events
+    functional = FunctionalSim(program)
+    functional.run()
+    for sim in (tomasulo, event_tomasulo):
+        assert sim.RegFile == functional.RegFile
+        assert bytes(sim.memory.data) == bytes(functional.memory.data)
+
+
+@pytest.mark.parametrize("kernel", list(bench.KERNELS))
+def test_checkpoint_resume(kernel):
+    program = bench.KERNELS[kernel](SIZE)
+    whole = Tomasulo(program, var_rs, execution_cycles, trace_level=TRACE_OFF)
+    expected = whole.run().as_dict()
+    first = Tomasulo(program, var_rs, execution_cycles, trace_level=TRACE_OFF)
+    first.run(stop_at_cycle=expected["clock_cycles"] // 2)
+    resumed = Tomasulo.from_checkpoint(first.checkpoint(), trace_level=TRACE_OFF)
+    assert resumed.run().as_dict() == expected
+    assert resumed.RegFile == whole.RegFile
+    assert bytes(resumed.memory.data) == bytes(whole.memory.data)
+
+
+@pytest.mark.parametrize("mode", ["base", "wide", "rob", "rename_no_rob"])
+@pytest.mark.parametrize("kernel", list(bench.KERNELS))
+def test_trace_driven(kernel, mode):
+    # A dynamic trace streamed through trace_driven mode runs every record once, never flushes, and
+    # ends in the program's state (JAL links trace positions, so R1 differs after a call)
+    functional = FunctionalSim(bench.KERNELS[kernel](SIZE))
+    trace = list(functional.trace())
+    for event_driven in (False, True):
+        tomasulo = Tomasulo(iter(trace), var_rs, execution_cycles, trace_level=TRACE_OFF, trace_driven=True,
+                            event_driven=event_driven, **MODES[mode])
+        result = tomasulo.run()
+        assert result.instructions == len(trace)
+        assert result.flushed == 0
+        skip = ["R1"] if any(record["op"] == "JAL" for record in trace) else []
+        assert ({reg: value for reg, value in tomasulo.RegFile.items() if reg not in skip}
+                == {reg: value for reg, value in functional.RegFile.items() if reg not in skip})
+        assert bytes(tomasulo.memory.data) == bytes(functional.memory.data)
+
+
+def test_result_cache(tmp_path):
+    program = bench.mem_loop(SIZE)
+    cache = ResultCache(str(tmp_path / "results"))
+    expected = Tomasulo(program, var_rs, execution_cycles, trace_level=TRACE_OFF).run().as_dict()
+    for run_number in range(2):
+        tomasulo = Tomasulo(program, var_rs, execution_cycles, trace_level=TRACE_OFF, result_cache=cache)
+        assert tomasulo.run().as_dict() == expected
+    assert [cache.misses, cache.hits] == [1, 1]
+    # A directory that cannot be written only means nothing is cached
+    not_a_dir = tmp_path / "file"
+    not_a_dir.write_text("")
+    cache = ResultCache(str(not_a_dir))
+    assert Tomasulo(program, var_rs, execution_cycles, trace_level=TRACE_OFF, result_cache=cache).run().as_dict() == expected
+
+
+@pytest.mark.parametrize("kernel", list(bench.KERNELS))
+def test_batch_matches_scalar(kernel):
+    # Looped kernels mispredict on every row alike; the gshare rows fall back to Tomasulo
+    pytest.importorskip("numpy")
+    from batch import BatchTomasulo
+    program = bench.KERNELS[kernel](SIZE)
+    configs = []
+    for k in range(12):
+        configs.append({"num_rs": {inst: 1 + (k + i) % 3 for i, inst in enumerate(var_rs)},
+                        "instruction_cycles": {inst: 1 + (k * 3 + i) % 5 for i, inst in enumerate(execution_cycles)},
+                        "num_cdb": 1 + k % 2, "issue_width": 1 + k % 3, "max_branches": 1 + k % 4,
+                        "predictor": "gshare" if k % 5 == 4 else "not_taken"})
+    rows = BatchTomasulo(program, configs).run()
+    for config, row in zip(configs, rows):
+        tomasulo = Tomasulo(program, trace_level=TRACE_OFF, **config)
+        assert row == tomasulo.run().as_dict()
+
+
+@pytest.mark.parametrize("config", [
+    {"instruction_cycles": {**execution_cycles, "ADDI": 0}},
+    {"num_rs": {**var_rs, "ADDI": 0}},
+    {"num_cdb": 0},
+    {"rob_size": 0},
+    {"issue_width": 0},
+    {"iq_size": 0},
+    {"num_fus": {"ADDI": 0}},
+    {"num_fus": {"ADDI": 1}, "initiation_interval": {"ADDI": 0}}
+])
+def test_bad_config_raises(config):
+    kwargs = {"num_rs": var_rs, "instruction_cycles": execution_cycles, **config}
+    with pytest.raises(ValueError):
+        Tomasulo(bench.dep_chain(4), trace_level=TRACE_OFF, **kwargs)
+
+
+def test_cli_config_arguments(tmp_path, capsys):
+    # A configuration may set any Tomasulo argument, the command line flags included
+    program = tmp_path / "loop.s"
+    program.write_text("ADDI R1, R0, 3\nloop: ADDI R1, R1, -1\nBNE R1, R0, loop\n")
+    config = tmp_path / "machine.json"
+    config.write_text(json.dumps({"event_driven": True, "trace_level": "summary", "rob_size": 4}))
+    out = tmp_path / "rows.jsonl"
+    assert Tom.main([str(program), "--config", str(config), "--trace", "off", "--out", str(out)]) == 0
+    [row] = [json.loads(line) for line in out.read_text().splitlines()]
+    assert row["error"] == ""
+    expected = Tomasulo(Tom.read_program(str(program)), var_rs, execution_cycles, trace_level=TRACE_OFF, rob_size=4)
+    assert row["clock_cycles"] == expected.run().clock_cycles
+    assert "Execution completed." not in capsys.readouterr().out # --trace off wins over the configuration